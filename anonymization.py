@@ -0,0 +1,125 @@
+'''
+Salted hashing of IP addresses in raw log lines, shared by the anonymizer and
+by the stripper when it reads raw logs directly.
+'''
+
+
+# 1st-party
+import binascii
+import functools
+import hashlib
+import os
+
+
+# Fixed-length columns on each line must be delimited by this string.
+DELIMITER = b' '
+
+# Random fixed-salt we never store anywhere
+SALT = os.urandom(256)
+# The hash state after hashing the salt, copied for every new IP address.
+SALTED_HASH = None
+
+# SHA-256 is compatible with existing datasets. Keyed BLAKE2b is faster, and
+# its 32-byte digest keeps the same 64-character hexdigest.
+HASH_ALGORITHMS = ('sha256', 'blake2b')
+
+# Most requests come from relatively few IP addresses, so remember the digests
+# of up to this many of them.
+CACHE_SIZE = 4*1024*1024
+
+# Logs are cut into blocks of about this many uncompressed bytes.
+BLOCK_SIZE = 64*1024*1024
+
+
+def init_hash(salt, hash_algorithm='sha256', cache_size=CACHE_SIZE):
+  global SALT, SALTED_HASH, anonymize_cached
+
+  SALT = salt
+
+  if hash_algorithm == 'sha256':
+    SALTED_HASH = hashlib.sha256(salt)
+  elif hash_algorithm == 'blake2b':
+    SALTED_HASH = hashlib.blake2b(key=salt[:hashlib.blake2b.MAX_KEY_SIZE],
+                                  digest_size=32)
+  else:
+    raise ValueError('Unknown hash algorithm: {}'.format(hash_algorithm))
+
+  # A new salt invalidates every digest we have seen so far.
+  anonymize_cached = functools.lru_cache(maxsize=cache_size)(anonymize)
+
+
+# Same digest as hashing SALT + encoded_message, but without hashing the salt
+# over again for every line.
+def anonymize(encoded_message):
+  salted_hash = SALTED_HASH.copy()
+  salted_hash.update(encoded_message)
+  return binascii.hexlify(salted_hash.digest())
+
+
+anonymize_cached = anonymize
+
+
+def anonymize_block(block, ip_field_index, output):
+  # Rewrite whole lines of raw bytes without decoding or splitting them: find
+  # the IP address field by the offsets of its delimiters, and copy the slices
+  # around it straight into the output buffer.
+  view = memoryview(block)
+  block_length = len(block)
+  line_start = 0
+
+  while line_start < block_length:
+    line_stop = block.find(b'\n', line_start)
+    if line_stop < 0:
+      line_stop = block_length
+    else:
+      line_stop += 1
+
+    field_start = line_start
+    for i in range(ip_field_index):
+      field_start = block.find(DELIMITER, field_start, line_stop)
+      assert field_start >= 0, bytes(view[line_start:line_stop])
+      field_start += 1
+
+    field_stop = block.find(DELIMITER, field_start, line_stop)
+    if field_stop < 0:
+      field_stop = line_stop
+
+    output += view[line_start:field_start]
+    # The cache key must be a copy, or it would keep the whole block alive.
+    output += anonymize_cached(block[field_start:field_stop])
+    output += view[field_stop:line_stop]
+
+    line_start = line_stop
+
+  view.release()
+
+
+def read_blocks(raw_log_file, block_size=BLOCK_SIZE):
+  while True:
+    block = raw_log_file.read(block_size)
+    if not block:
+      break
+
+    # Finish the last line in this block.
+    if not block.endswith(b'\n'):
+      block += raw_log_file.readline()
+    yield block
+
+
+def read_byte_range(filepath, start, stop):
+  # A line belongs to the byte range in which it begins. So, unless we are at
+  # the beginning of the file, skip the line that the previous range owns.
+  with open(filepath, 'rb') as file_in:
+    if start > 0:
+      file_in.seek(start-1)
+      file_in.readline()
+
+    begin = file_in.tell()
+    if begin >= stop:
+      return b''
+
+    # Finish the last line that begins in this byte range.
+    block = file_in.read(stop-begin)
+    if not block.endswith(b'\n'):
+      block += file_in.readline()
+    return block
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+'''
+A sorted simple log, compressed in independent blocks, with a sidecar index of
+the byte range and the first and last timestamp of every block.
+
+Since every block is a complete xz (or otherwise) stream, the whole file is
+still an ordinary .xz file that xzcat or compression.open can read from byte
+zero. But, with the index, a reader can decode blocks in parallel, and skip
+the blocks outside of a time range altogether.
+
+USAGE: python3 block_log.py [--codec CODEC] SORTED_SIMPLE_LOG
+Writes SORTED_SIMPLE_LOG.EXT and SORTED_SIMPLE_LOG.EXT.index, and then removes
+SORTED_SIMPLE_LOG.
+'''
+
+
+# 1st-party
+import argparse
+import io
+import json
+import multiprocessing
+import os
+
+# 2nd-party
+import compression
+import parallel
+
+
+INDEX_EXTENSION = '.index'
+
+# Every block holds about this many uncompressed bytes.
+BLOCK_SIZE = 16*1024*1024
+
+
+# Every line of a simple log begins with "unix_timestamp",...
+def get_timestamp(line):
+  return int(line[1:line.index(b'"', 1)])
+
+
+def get_index_filepath(filepath):
+  return filepath + INDEX_EXTENSION
+
+
+class BlockLogWriter:
+
+
+  # To append, the file must have an index, and every line must come no
+  # earlier than its last line.
+  def __init__(self, filepath, codec=compression.DEFAULT_CODEC,
+               block_size=BLOCK_SIZE, append=False):
+    self.filepath = filepath
+    self.codec = codec
+    self.block_size = block_size
+
+    self.block = bytearray()
+    self.block_lines = 0
+    self.first_timestamp = None
+    self.last_timestamp = None
+
+    if append:
+      index = read_index(filepath)
+      assert index is not None, filepath
+      assert index['codec'] == codec, index['codec']
+      # Cut off what an append that crashed before its index wrote.
+      if 'size' in index:
+        os.truncate(filepath, index['size'])
+      # [[offset, length, first_timestamp, last_timestamp, lines], ...]
+      self.blocks = index['blocks']
+      if self.blocks:
+        self.last_timestamp = self.blocks[-1][3]
+      self.file = open(filepath, 'ab')
+
+    else:
+      self.blocks = []
+      self.file = open(filepath, 'wb')
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+
+  # Lines must be given in order of time.
+  def write(self, line):
+    timestamp = get_timestamp(line)
+    assert self.last_timestamp is None or self.last_timestamp <= timestamp
+
+    if self.first_timestamp is None:
+      self.first_timestamp = timestamp
+    self.last_timestamp = timestamp
+
+    self.block += line
+    self.block_lines += 1
+
+    if len(self.block) >= self.block_size:
+      self.flush_block()
+
+
+  def flush_block(self):
+    if not self.block:
+      return
+
+    compressed_block = compression.compress(self.block, self.codec)
+    self.blocks.append([self.file.tell(), len(compressed_block),
+                        self.first_timestamp, self.last_timestamp,
+                        self.block_lines])
+    self.file.write(compressed_block)
+
+    del self.block[:]
+    self.block_lines = 0
+    self.first_timestamp = None
+
+
+  def close(self):
+    if self.file.closed:
+      return
+
+    self.flush_block()
+    self.file.close()
+
+    # The size of the log, so that an index is never used with another log.
+    with open(get_index_filepath(self.filepath), 'wt') as index_file:
+      json.dump({'codec': self.codec, 'blocks': self.blocks,
+                 'size': os.path.getsize(self.filepath)}, index_file)
+
+
+# None if there is no index, or if it is not of this log. An index of a shorter
+# log is of the same log, with blocks that an append wrote before it crashed,
+# and which readers of the index never see: logs are replaced only after their
+# index is removed.
+def read_index(filepath):
+  index_filepath = get_index_filepath(filepath)
+
+  if os.path.exists(index_filepath):
+    with open(index_filepath, 'rt') as index_file:
+      index = json.load(index_file)
+
+    if 'size' in index and index['size'] > os.path.getsize(filepath):
+      return None
+    return index
+
+  else:
+    return None
+
+
+def get_last_timestamp(filepath):
+  index = read_index(filepath)
+  if index is None or not index['blocks']:
+    return None
+  return index['blocks'][-1][3]
+
+
+def read_block(filepath, offset, length, codec):
+  with open(filepath, 'rb') as fp:
+    fp.seek(offset)
+    return compression.decompress(fp.read(length), codec)
+
+
+def filter_lines(lines, since, until):
+  for line in lines:
+    timestamp = get_timestamp(line)
+    if (since is None or since <= timestamp) and \
+       (until is None or timestamp < until):
+      yield line
+
+
+def read_blocks(filepath, since=None, until=None, jobs=1):
+  '''
+  parameters:
+    since, until:
+      if not None, yield only blocks with lines where since <= timestamp <
+      until. Blocks at the edges of the time range may hold lines outside it.
+    jobs:
+      number of processes that decode blocks in parallel.
+
+  return:
+    A generator of blocks of whole lines, as bytes, in the order of the file.
+  '''
+
+  index = read_index(filepath)
+
+  # Without an index, there is nothing to do but read the whole file, and cut
+  # it into blocks ourselves.
+  if index is None:
+    with compression.open(filepath, 'rb') as fp:
+      remainder = b''
+      while True:
+        data = fp.read(BLOCK_SIZE)
+        if not data:
+          break
+        block = remainder + data
+        end = block.rfind(b'\n')+1
+        remainder = block[end:]
+        if end:
+          yield block[:end]
+      if remainder:
+        yield remainder
+    return
+
+  # Pick only the blocks that overlap [since, until).
+  argss = []
+  for offset, length, first_timestamp, last_timestamp, lines in \
+                                                              index['blocks']:
+    if (since is None or since <= last_timestamp) and \
+       (until is None or first_timestamp < until):
+      argss.append((filepath, offset, length, index['codec']))
+
+  if jobs > 1:
+    pool = multiprocessing.Pool(jobs)
+  else:
+    pool = None
+
+  try:
+    yield from parallel.map_in_order(pool, read_block, argss, window=jobs*2)
+
+  finally:
+    if pool is not None:
+      pool.terminate()
+
+
+def read_lines(filepath, since=None, until=None, jobs=1):
+  '''
+  parameters:
+    since, until:
+      if not None, yield only lines where since <= timestamp < until.
+    jobs:
+      number of processes that decode blocks in parallel.
+
+  return:
+    A generator of lines, as bytes, in the order of the file.
+  '''
+
+  for block in read_blocks(filepath, since, until, jobs):
+    # Only at newlines: splitlines would also split at the \r that some user
+    # agents hold.
+    lines = io.BytesIO(block).readlines()
+    # Blocks at the edges of the time range may hold lines outside it.
+    if since is None and until is None:
+      yield from lines
+    else:
+      yield from filter_lines(lines, since, until)
+
+
+if __name__ == '__main__':
+  # rw for owner and group but not others
+  os.umask(0o07)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--codec', default=compression.DEFAULT_CODEC,
+                      choices=compression.CODECS)
+  parser.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+  parser.add_argument('filepath')
+  args = parser.parse_args()
+  # The block log would overwrite the log it is written from.
+  if args.codec == 'none':
+    parser.error('--codec none would write the block log over the log')
+
+  block_log_filepath = args.filepath + compression.EXTENSIONS[args.codec]
+
+  with open(args.filepath, 'rb') as file_in, \
+       BlockLogWriter(block_log_filepath, args.codec,
+                      args.block_size) as block_log_writer:
+    for line in file_in:
+      block_log_writer.write(line)
+
+  os.remove(args.filepath)
+  print(block_log_filepath)
@@ -0,0 +1,91 @@
+'''
+Checkpoints of long scans, so that a scan that crashes or is killed hours in
+resumes where it left off, instead of from the first line.
+
+A checkpoint is a JSON file that holds whatever the scan needs to resume:
+usually, how far into its input it got, its counters, and the state of its
+visitors, including how much of their output is good. It is replaced
+atomically, so that a scan killed while saving it leaves the last one intact.
+'''
+
+
+# 1st-party
+import json
+import os
+import time
+
+
+# Save at most once every this many seconds.
+INTERVAL = 10*60
+
+# Skip ahead in unseekable (e.g. piped) files in reads of this many bytes.
+SKIP_SIZE = 16*1024*1024
+
+
+class Checkpoint:
+
+
+  def __init__(self, filepath, interval=INTERVAL):
+    self.filepath = filepath
+    self.interval = interval
+
+    if os.path.exists(filepath):
+      with open(filepath, 'rt') as checkpoint_file:
+        self.state = json.load(checkpoint_file)
+    else:
+      self.state = {}
+
+    self.last_save_time = time.monotonic()
+
+
+  # Whether there is anything to resume from.
+  def __bool__(self):
+    return bool(self.state)
+
+
+  def get(self, key, default=None):
+    return self.state.get(key, default)
+
+
+  def is_due(self):
+    return time.monotonic()-self.last_save_time >= self.interval
+
+
+  def save(self, **state):
+    self.state.update(state)
+
+    temporary_filepath = self.filepath + '.tmp'
+    with open(temporary_filepath, 'wt') as checkpoint_file:
+      json.dump(self.state, checkpoint_file)
+      checkpoint_file.flush()
+      os.fsync(checkpoint_file.fileno())
+    os.replace(temporary_filepath, self.filepath)
+
+    self.last_save_time = time.monotonic()
+
+
+  # Once the scan is done, there is nothing to resume.
+  def remove(self):
+    if os.path.exists(self.filepath):
+      os.remove(self.filepath)
+    self.state = {}
+
+
+# Skip the first offset (uncompressed) bytes of a file.
+def skip(file, offset):
+  if file.seekable():
+    file.seek(offset)
+    return
+
+  while offset > 0:
+    data = file.read(min(offset, SKIP_SIZE))
+    if not data:
+      raise EOFError('Cannot skip past the end of {}'.format(file))
+    offset -= len(data)
+
+
+# Truncate an output file back to the position of the last checkpoint, and
+# open it to append from there.
+def reopen(filepath, position, mode='at'):
+  os.truncate(filepath, position)
+  return open(filepath, mode)
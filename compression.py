@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+'''
+One place to open every intermediate file, compressed or not.
+
+Files are written with a selectable codec: multi-threaded xz, zstd, gzip or
+none at all. Files are read with whatever codec their magic bytes say, so
+scripts need not care which codec wrote them. That way, we can trade disk
+space for the speed of rerunning an analysis.
+
+USAGE: python3 compression.py [--codec CODEC] FILE1 ... FILE-N
+Like xz, compresses every FILE into FILE.EXT, and then removes FILE.
+'''
+
+
+# 1st-party
+import argparse
+import builtins
+import gzip
+import io
+import lzma
+import os
+import shutil
+import signal
+import subprocess
+
+# 3rd-party
+# Optional, used only if the zstd command is not installed.
+# pip3 install zstandard
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+
+CODECS = ('xz', 'zstd', 'gzip', 'none')
+DEFAULT_CODEC = 'xz'
+EXTENSIONS = {'xz': '.xz', 'zstd': '.zst', 'gzip': '.gz', 'none': ''}
+
+# http://www.garykessler.net/library/file_sigs.html
+MAGIC_BYTES = ((b'\xfd7zXZ\x00', 'xz'),
+               (b'\x28\xb5\x2f\xfd', 'zstd'),
+               (b'\x1f\x8b', 'gzip'))
+MAGIC_BYTES_LENGTH = max(len(magic_bytes) for magic_bytes, codec in \
+                                                                MAGIC_BYTES)
+
+# 0 means as many threads as there are cores.
+THREADS = 0
+
+
+def detect_codec(filepath):
+  with builtins.open(filepath, 'rb') as fp:
+    header = fp.read(MAGIC_BYTES_LENGTH)
+
+  for magic_bytes, codec in MAGIC_BYTES:
+    if header.startswith(magic_bytes):
+      return codec
+
+  return 'none'
+
+
+def get_codec_by_extension(filepath):
+  for codec, extension in EXTENSIONS.items():
+    if extension and filepath.endswith(extension):
+      return codec
+
+  return 'none'
+
+
+# Pipes a file through an external command, such as xz, that can use more than
+# one core, unlike the lzma module.
+class ProcessFile(io.BufferedIOBase):
+
+
+  def __init__(self, args, filepath, mode):
+    self.mode = mode
+    self.name = filepath
+
+    if mode == 'rb':
+      self.file = None
+      self.process = subprocess.Popen(args + [filepath],
+                                      stdout=subprocess.PIPE)
+      self.pipe = self.process.stdout
+
+    else:
+      assert mode == 'wb', mode
+      self.file = builtins.open(filepath, 'wb')
+      self.process = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                      stdout=self.file)
+      self.pipe = self.process.stdin
+
+
+  def readable(self):
+    return self.mode == 'rb'
+
+
+  def writable(self):
+    return self.mode == 'wb'
+
+
+  def read(self, size=-1):
+    return self.pipe.read(size)
+
+
+  def read1(self, size=-1):
+    return self.pipe.read1(size)
+
+
+  def readline(self, size=-1):
+    return self.pipe.readline(size)
+
+
+  def write(self, data):
+    return self.pipe.write(data)
+
+
+  def close(self):
+    if self.closed:
+      return
+
+    try:
+      self.pipe.close()
+      returncode = self.process.wait()
+
+    finally:
+      if self.file is not None:
+        self.file.close()
+      super().close()
+
+    # A reader that stops early, well, stops the command with a broken pipe.
+    if returncode != 0 and \
+       not (self.mode == 'rb' and returncode == -signal.SIGPIPE):
+      raise OSError('{} exited with {} on {}'.format(self.process.args[0],
+                                                     returncode, self.name))
+
+
+# Whether the codec can be read and written here: zstd needs its command or
+# module, and the others need only the standard library.
+def is_available(codec):
+  assert codec in CODECS, codec
+  if codec == 'zstd':
+    return shutil.which('zstd') is not None or zstandard is not None
+  return True
+
+
+def open_binary(filepath, mode, codec, threads):
+  if codec == 'xz':
+    xz = shutil.which('xz')
+    if xz:
+      if mode == 'rb':
+        return ProcessFile([xz, '-dc', '-T{}'.format(threads)], filepath, mode)
+      else:
+        return ProcessFile([xz, '-c', '-T{}'.format(threads)], filepath, mode)
+    else:
+      return lzma.open(filepath, mode)
+
+  elif codec == 'zstd':
+    zstd = shutil.which('zstd')
+    if zstd:
+      if mode == 'rb':
+        return ProcessFile([zstd, '-dcq'], filepath, mode)
+      else:
+        return ProcessFile([zstd, '-cq', '-T{}'.format(threads)], filepath,
+                           mode)
+    elif zstandard is not None:
+      return zstandard.open(filepath, mode)
+    else:
+      raise OSError('Need the zstd command or module for {}'.format(filepath))
+
+  elif codec == 'gzip':
+    return gzip.open(filepath, mode)
+
+  else:
+    assert codec == 'none', codec
+    return builtins.open(filepath, mode)
+
+
+def open(filepath, mode='rb', codec=None, threads=THREADS, encoding='utf-8'):
+  '''
+  parameters:
+    mode:
+      'r', 'rb' or 'rt' to read, or 'w', 'wb' or 'wt' to write.
+    codec:
+      if None:
+        when reading, detected from the magic bytes of the file.
+        when writing, guessed from the extension of the filepath.
+
+  return:
+    A file object like those of lzma.open.
+  '''
+
+  binary_mode = mode.replace('t', '').replace('b', '') + 'b'
+  assert binary_mode in ('rb', 'wb'), mode
+
+  if codec is None:
+    if binary_mode == 'rb':
+      codec = detect_codec(filepath)
+    else:
+      codec = get_codec_by_extension(filepath)
+  assert codec in CODECS, codec
+
+  binary_file = open_binary(filepath, binary_mode, codec, threads)
+
+  if 't' in mode:
+    return io.TextIOWrapper(binary_file, encoding=encoding)
+  else:
+    return binary_file
+
+
+# Compress a chunk on its own. Chunks compressed by the same codec can simply
+# be concatenated into one file.
+def compress(data, codec=DEFAULT_CODEC):
+  if codec == 'xz':
+    return lzma.compress(data)
+
+  elif codec == 'zstd':
+    if zstandard is not None:
+      return zstandard.ZstdCompressor().compress(data)
+    else:
+      return subprocess.run(['zstd', '-cq'], input=data, check=True,
+                            stdout=subprocess.PIPE).stdout
+
+  elif codec == 'gzip':
+    return gzip.compress(data)
+
+  else:
+    assert codec == 'none', codec
+    return bytes(data)
+
+
+def decompress(data, codec):
+  if codec == 'xz':
+    return lzma.decompress(data)
+
+  elif codec == 'zstd':
+    if zstandard is not None:
+      decompressor = zstandard.ZstdDecompressor()
+      return decompressor.stream_reader(io.BytesIO(data),
+                                        read_across_frames=True).read()
+    else:
+      return subprocess.run(['zstd', '-dcq'], input=data, check=True,
+                            stdout=subprocess.PIPE).stdout
+
+  elif codec == 'gzip':
+    return gzip.decompress(data)
+
+  else:
+    assert codec == 'none', codec
+    return bytes(data)
+
+
+if __name__ == '__main__':
+  # rw for owner and group but not others
+  os.umask(0o07)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--codec', default=DEFAULT_CODEC, choices=CODECS)
+  parser.add_argument('--threads', type=int, default=THREADS)
+  parser.add_argument('filepaths', nargs='+')
+  args = parser.parse_args()
+
+  for filepath in args.filepaths:
+    if args.codec == 'none':
+      continue
+
+    compressed_filepath = filepath + EXTENSIONS[args.codec]
+    with builtins.open(filepath, 'rb') as file_in, \
+         open(compressed_filepath, 'wb', args.codec, args.threads) as file_out:
+      shutil.copyfileobj(file_in, file_out)
+
+    os.remove(filepath)
+    print(compressed_filepath)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+'''
+A columnar event store of the sorted simple log: one NumPy array per field,
+saved as .npy files that readers memory-map instead of parsing text. Strings
+are stored as their ids in the shared dictionaries of string_ids:
+
+  DIRECTORY/timestamps.npy      int64 Unix timestamps, in order
+  DIRECTORY/ip_address_ids.npy  int32 ids into ip_addresses
+  DIRECTORY/project_ids.npy     int32 ids into projects
+  DIRECTORY/url_ids.npy         int32 ids into urls
+  DIRECTORY/user_agent_ids.npy  int16 ids into user_agents
+
+Readers of a time range find its rows by binary search of the timestamps, and
+touch only the pages of the columns they need.
+
+USAGE: python3 event_store.py [-j JOBS] [--dictionaries DIR]
+                             [SORTED_SIMPLE_LOG] [DIRECTORY]
+Converts SORTED_SIMPLE_LOG (a block log, or a directory of partitions) into
+an event store in DIRECTORY.
+'''
+
+
+# 1st-party
+import argparse
+import array
+import collections
+import os
+
+# 3rd-party
+import numpy
+
+# 2nd-party
+import partitioned_log
+import string_ids
+import translation_cache
+
+
+SORTED_SIMPLE_LOG_FILEPATH = \
+  '/var/experiments-output/simple/sorted.simple.log.xz'
+EVENT_STORE_DIRECTORY = '/var/experiments-output/simple/events'
+
+# column: (dtype, array typecode, dictionary)
+COLUMNS = collections.OrderedDict((
+  ('timestamps', ('int64', 'q', None)),
+  ('ip_address_ids', ('int32', 'i', 'ip_addresses')),
+  ('project_ids', ('int32', 'i', 'projects')),
+  ('url_ids', ('int32', 'i', 'urls')),
+  # int32 while building, in case there are too many user agents for int16.
+  ('user_agent_ids', ('int16', 'i', 'user_agents')),
+))
+
+# Rows of the columns, as NumPy arrays.
+Events = collections.namedtuple('Events', COLUMNS.keys())
+
+# Build columns in memory in chunks of this many rows.
+CHUNK_SIZE = 1024*1024
+
+
+def get_column_filepath(directory, column):
+  return os.path.join(directory, column + '.npy')
+
+
+def is_event_store(filepath):
+  return os.path.isfile(get_column_filepath(filepath, 'timestamps'))
+
+
+# "unix_timestamp","ip_address","url","user_agent"\n
+# Neither IP addresses nor (quoted) URLs hold quotes, but user agents might.
+def split_line(line):
+  return line.decode('utf-8').rstrip('\n')[1:-1].split('","', 3)
+
+
+# Copy a raw column, chunk by chunk, into a .npy file of the given dtype.
+def save_column(raw_filepath, typecode, column_filepath, dtype):
+  itemsize = array.array(typecode).itemsize
+  length = os.path.getsize(raw_filepath) // itemsize
+  column = numpy.lib.format.open_memmap(column_filepath, mode='w+',
+                                        dtype=dtype, shape=(length,))
+
+  with open(raw_filepath, 'rb') as raw_file:
+    start = 0
+    while start < length:
+      chunk = numpy.frombuffer(raw_file.read(CHUNK_SIZE*itemsize),
+                               dtype=typecode)
+      column[start:start+len(chunk)] = chunk
+      start += len(chunk)
+
+  column.flush()
+  del column
+  os.remove(raw_filepath)
+
+
+def build(sorted_simple_log_filepath, directory, since=None, until=None,
+          jobs=1, dictionary_directory=string_ids.DIRECTORY):
+  os.makedirs(directory, exist_ok=True)
+  dictionaries = {dictionary: string_ids.load(dictionary, dictionary_directory)
+                  for dtype, typecode, dictionary in COLUMNS.values()
+                  if dictionary is not None}
+  ip_addresses = dictionaries['ip_addresses']
+  projects = dictionaries['projects']
+  urls = dictionaries['urls']
+  user_agents = dictionaries['user_agents']
+  # url_id: project_id, so that we infer the project of every URL only once.
+  url_projects = {}
+
+  raw_filepaths = {column: os.path.join(directory, column + '.raw')
+                   for column in COLUMNS}
+  raw_files = {column: open(raw_filepath, 'wb')
+               for column, raw_filepath in raw_filepaths.items()}
+  line_counter = 0
+
+  def new_chunk():
+    return {column: array.array(typecode)
+            for column, (dtype, typecode, dictionary) in COLUMNS.items()}
+
+  def write_chunk(chunk):
+    for column, values in chunk.items():
+      values.tofile(raw_files[column])
+
+  try:
+    chunk = new_chunk()
+    timestamps = chunk['timestamps']
+
+    for line in partitioned_log.read_lines(sorted_simple_log_filepath, since,
+                                           until, jobs):
+      unix_timestamp, ip_address, url, user_agent = split_line(line)
+
+      url_id = urls.get_id(url)
+      project_id = url_projects.get(url_id)
+      if project_id is None:
+        project_id = \
+          projects.get_id(translation_cache.infer_package_name(url))
+        url_projects[url_id] = project_id
+
+      timestamps.append(int(unix_timestamp))
+      chunk['ip_address_ids'].append(ip_addresses.get_id(ip_address))
+      chunk['project_ids'].append(project_id)
+      chunk['url_ids'].append(url_id)
+      chunk['user_agent_ids'].append(user_agents.get_id(user_agent))
+      line_counter += 1
+
+      if len(timestamps) >= CHUNK_SIZE:
+        write_chunk(chunk)
+        chunk = new_chunk()
+        timestamps = chunk['timestamps']
+
+    write_chunk(chunk)
+
+  finally:
+    for raw_file in raw_files.values():
+      raw_file.close()
+
+  # Save the new ids before any column refers to them.
+  for dictionary in dictionaries.values():
+    dictionary.save()
+
+  for column, (dtype, typecode, dictionary) in COLUMNS.items():
+    # Not likely, but if there are too many user agents, keep their ids wide.
+    if dictionary is not None and \
+       len(dictionaries[dictionary]) > numpy.iinfo(dtype).max+1:
+      dtype = 'int32'
+
+    save_column(raw_filepaths[column], typecode,
+                get_column_filepath(directory, column), dtype)
+
+  return line_counter
+
+
+class EventStore:
+
+
+  def __init__(self, directory, mmap_mode='r',
+               dictionary_directory=string_ids.DIRECTORY):
+    self.directory = directory
+    self.dictionary_directory = dictionary_directory
+    self.columns = {column: numpy.load(get_column_filepath(directory, column),
+                                       mmap_mode=mmap_mode)
+                    for column in COLUMNS}
+    self.timestamps = self.columns['timestamps']
+    # dictionary: [string, ...], read only when needed.
+    self.dictionaries = {}
+
+
+  def __len__(self):
+    return len(self.timestamps)
+
+
+  def get_strings(self, dictionary):
+    strings = self.dictionaries.get(dictionary)
+
+    if strings is None:
+      strings = string_ids.read_strings(dictionary,
+                                        self.dictionary_directory)
+      self.dictionaries[dictionary] = strings
+
+    return strings
+
+
+  # A boolean array, indexed by id, of whether the string is in the given set.
+  def get_mask(self, dictionary, strings):
+    strings = set(strings)
+    return numpy.fromiter((string in strings
+                           for string in self.get_strings(dictionary)),
+                          dtype=bool)
+
+
+  # The rows where since <= timestamp < until, by binary search.
+  def get_slice(self, since=None, until=None):
+    if since is None:
+      start = 0
+    else:
+      start = int(numpy.searchsorted(self.timestamps, since, side='left'))
+
+    if until is None:
+      stop = len(self.timestamps)
+    else:
+      stop = int(numpy.searchsorted(self.timestamps, until, side='left'))
+
+    return slice(start, stop)
+
+
+  # Views of the columns where since <= timestamp < until. Nothing is read
+  # until used.
+  def select(self, since=None, until=None):
+    rows = self.get_slice(since, until)
+    return Events(**{column: values[rows]
+                     for column, values in self.columns.items()})
+
+
+if __name__ == '__main__':
+  # rw for owner and group but not others
+  os.umask(0o07)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                      help='Number of processes that decode blocks')
+  parser.add_argument('sorted_simple_log_filepath', nargs='?',
+                      default=SORTED_SIMPLE_LOG_FILEPATH)
+  parser.add_argument('directory', nargs='?', default=EVENT_STORE_DIRECTORY)
+  parser.add_argument('--dictionaries', default=string_ids.DIRECTORY,
+                      help='Directory of the shared string dictionaries')
+  args = parser.parse_args()
+
+  line_counter = build(args.sorted_simple_log_filepath, args.directory,
+                       jobs=args.jobs, dictionary_directory=args.dictionaries)
+  print('W {} ({:,} lines)'.format(args.directory, line_counter))
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+
+'''
+A microbenchmark for decoding the HTTP dates of a recorded log with strptime,
+and with http_date.decode.
+
+USAGE: python3 http-date-microbenchmark.py [--lines N] ANONYMIZED_LOG
+'''
+
+
+# 1st-party
+import argparse
+import itertools
+import time
+
+# 2nd-party
+import compression
+import http_date
+
+
+# Between the first pair of quotes on every line.
+def read_timestamp_strings(log_filepath, number_of_lines):
+  timestamp_strings = []
+
+  with compression.open(log_filepath, 'rb') as log_file:
+    for line in itertools.islice(log_file, number_of_lines):
+      start = line.index(b'"')+1
+      stop = line.index(b'"', start)
+      timestamp_strings.append(line[start:stop].decode('utf-8'))
+
+  return timestamp_strings
+
+
+def benchmark(decode, timestamp_strings):
+  start_time = time.perf_counter()
+  unix_timestamps = [decode(timestamp_string)
+                     for timestamp_string in timestamp_strings]
+  return unix_timestamps, time.perf_counter()-start_time
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--lines', type=int, default=1000000)
+  parser.add_argument('log_filepath')
+  args = parser.parse_args()
+
+  timestamp_strings = read_timestamp_strings(args.log_filepath, args.lines)
+  print('{:,} timestamps, {:,} distinct'.format(len(timestamp_strings),
+                                                len(set(timestamp_strings))))
+
+  expected, strptime_seconds = benchmark(http_date.strptime,
+                                         timestamp_strings)
+  actual, decode_seconds = benchmark(http_date.decode, timestamp_strings)
+  assert actual == expected
+
+  for name, seconds in (('strptime', strptime_seconds),
+                        ('http_date.decode', decode_seconds)):
+    print('{}: {:.3f}s ({:,.0f} dates/s)'.format(name, seconds,
+                                                 len(timestamp_strings) /
+                                                 seconds))
+  print('Speedup: {:.1f}x'.format(strptime_seconds/decode_seconds))
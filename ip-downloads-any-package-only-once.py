@@ -1,15 +1,17 @@
 #!/usr/bin/env python3
 
-import collections
 import sys
 
+import spill_aggregator
+
 # {
 #   "127.0.0.1": {
 #       "Django-1.5.tar.gz": 42,
 #       "virtualenv-1.7.tar.gz": 1
 #   }
 # }
-ips = {}
+# Spilled to disk when there are too many to keep in memory.
+ips = spill_aggregator.CounterAggregator()
 
 assert len(sys.argv) == 2
 filename = sys.argv[1]
@@ -17,7 +19,7 @@ filename = sys.argv[1]
 with open(filename, 'rt') as log:
   for request in log:
     ip, package = request.split(',')
-    ips.setdefault(ip, collections.Counter())[package] += 1
+    ips.add(ip, package)
 
 for ip, packages in ips.items():
   # If the IP has downloaded each package only once, then the total number of
@@ -26,3 +28,4 @@ for ip, packages in ips.items():
   if sum(packages.values()) == len(packages):
     print(ip)
 
+ips.close()
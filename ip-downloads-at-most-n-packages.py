@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
-import collections
 import sys
 
-ips = {}
+import spill_aggregator
+
+# Spilled to disk when there are too many to keep in memory.
+ips = spill_aggregator.CounterAggregator()
 n = 100
 
 assert len(sys.argv) == 2
@@ -12,10 +14,11 @@ filename = sys.argv[1]
 with open(filename, 'rt') as log:
   for request in log:
     ip, package = request.split(',')
-    ips.setdefault(ip, collections.Counter())[package] += 1
+    ips.add(ip, package)
 
 for ip, packages in ips.items():
   # If the user has downloaded up to n packages, then keep this user.
   if len(packages) <= n:
     print(ip)
 
+ips.close()
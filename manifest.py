@@ -0,0 +1,84 @@
+'''
+A manifest of the input files that a stage has already processed, so that it
+need only process the new ones.
+
+Every file is recorded with its size, mtime and SHA-256. A file is processed
+if its size and mtime are as recorded, or, failing that, if its content is:
+e.g., a log that was copied again, but not changed.
+'''
+
+
+# 1st-party
+import hashlib
+import json
+import os
+
+
+# Hash files in reads of this many bytes.
+READ_SIZE = 16*1024*1024
+
+
+def get_sha256(filepath):
+  sha256 = hashlib.sha256()
+
+  with open(filepath, 'rb') as fp:
+    while True:
+      data = fp.read(READ_SIZE)
+      if not data:
+        break
+      sha256.update(data)
+
+  return sha256.hexdigest()
+
+
+class Manifest:
+
+
+  def __init__(self, filepath):
+    self.filepath = filepath
+
+    if os.path.exists(filepath):
+      with open(filepath, 'rt') as manifest_file:
+        # filepath: {'size': ..., 'mtime': ..., 'sha256': ...}
+        self.files = json.load(manifest_file)
+    else:
+      self.files = {}
+
+
+  def __contains__(self, filepath):
+    return self.is_processed(filepath)
+
+
+  def is_processed(self, filepath):
+    entry = self.files.get(os.path.abspath(filepath))
+    if entry is None:
+      return False
+
+    stat = os.stat(filepath)
+    if stat.st_size != entry['size']:
+      return False
+    if stat.st_mtime == entry['mtime']:
+      return True
+
+    # Touched, but perhaps not changed.
+    if get_sha256(filepath) == entry['sha256']:
+      entry['mtime'] = stat.st_mtime
+      return True
+    else:
+      return False
+
+
+  def add(self, filepath):
+    stat = os.stat(filepath)
+    self.files[os.path.abspath(filepath)] = {
+      'size': stat.st_size,
+      'mtime': stat.st_mtime,
+      'sha256': get_sha256(filepath),
+    }
+
+
+  def save(self):
+    temporary_filepath = self.filepath + '.tmp'
+    with open(temporary_filepath, 'wt') as manifest_file:
+      json.dump(self.files, manifest_file, sort_keys=True, indent=1)
+    os.replace(temporary_filepath, self.filepath)
@@ -1,17 +1,32 @@
 #!/usr/bin/env python3
 
+'''
+USAGE: python3 measure-slashdot-effect.py [--release T] [--days D]
+                                          [--total N] [PACKAGE]
+Prints when, and after how many downloads, PACKAGE (a URL or package filename)
+was downloaded more than D days after its release at T.
+'''
+
 
 # 1st-party
+import argparse
 import collections
-import csv
-import lzma
+import functools
 import os
 import re
 
+# 3rd-party
+import numpy
+
+# 2nd-party
+import url_index
+
 
 CHANGELOG_FILENAME = '/var/experiments-output/1395360000-1397952000.changelog'
 SORTED_SIMPLE_LOG_FILENAME = \
   '/var/experiments-output/simple/sorted.simple.log.xz'
+# Decode the blocks of the log with this many processes.
+JOBS = os.cpu_count()
 
 
 def get_new_projects_from_changelog():
@@ -42,42 +57,40 @@ def get_new_packages_from_changelog(projects):
   return packages
  
 
-def measure(packages):
-  package_downloads = collections.Counter()
-
-  with lzma.open(SORTED_SIMPLE_LOG_FILENAME, 'rt') as sorted_simple_log_file:
-    sorted_simple_log_file = csv.reader(sorted_simple_log_file)
+# Built from the log, in one pass, the first time.
+@functools.lru_cache(maxsize=None)
+def load_url_index():
+  return url_index.load(SORTED_SIMPLE_LOG_FILENAME, JOBS)
 
-    for line in sorted_simple_log_file:
-      unix_timestamp, ip_address, url, user_agent = line
 
-      if url.startswith('/packages/'):
-        filename = os.path.basename(url)
+def measure(packages):
+  index = load_url_index()
+  package_downloads = collections.Counter()
 
-        if filename in packages:
-          package_downloads[filename] += 1
+  for filename in packages:
+    downloads = index.count(filename)
+    if downloads > 0:
+      package_downloads[filename] = downloads
 
   return package_downloads.most_common()
  
 
-def count(package, max_timestamp, total_downloads):
-  with lzma.open(SORTED_SIMPLE_LOG_FILENAME, 'rt') as sorted_simple_log_file:
-    sorted_simple_log_file = csv.reader(sorted_simple_log_file)
-    counter = 0
-
-    for line in sorted_simple_log_file:
-      unix_timestamp, ip_address, url, user_agent = line
-      unix_timestamp = int(unix_timestamp)
+# Nobody downloads a package before its release, so skip straight to it.
+def count(package, max_timestamp, total_downloads=None,
+          release_timestamp=None):
+  timestamps = load_url_index().get_downloads(package)
+  if total_downloads is None:
+    total_downloads = len(timestamps)
 
-      if url == package:
-        counter += 1
-        percent = (counter / total_downloads) * 100
+  start = 0 if release_timestamp is None else \
+          int(numpy.searchsorted(timestamps, release_timestamp))
+  # The first download after max_timestamp, and all before it.
+  stop = int(numpy.searchsorted(timestamps, max_timestamp, side='right'))
 
-        # The danger of dynamic typing: Python will happily compare a string
-        # with an integer without any warning.
-        if unix_timestamp > max_timestamp:
-          print('{} {} {}%'.format(unix_timestamp, counter, percent))
-          break
+  if stop < len(timestamps):
+    counter = stop - start + 1
+    percent = (counter / total_downloads) * 100
+    print('{} {} {}%'.format(timestamps[stop], counter, percent))
 
 
 if __name__ == '__main__':
@@ -93,11 +106,22 @@ if __name__ == '__main__':
   #print(package_downloads)
   #print()
 
+  # rw for owner and group but not others
+  os.umask(0o07)
+
+  parser = argparse.ArgumentParser()
   # Found to be the most downloaded new package.
-  most_downloaded_new_package = '/packages/source/d/django-cms/django-cms-2.4.3.tar.gz'
+  parser.add_argument('package', nargs='?',
+                      default='/packages/source/d/django-cms/'\
+                              'django-cms-2.4.3.tar.gz',
+                      help='URL or package filename')
+  parser.add_argument('--release', type=int, default=1397219572,
+                      help='Unix timestamp of the release of the package')
   # Offset from time of release.
-  max_timestamp = 1397219572 + (1 * 24 * 60 * 60)
-  total_downloads = 4170
-  count(most_downloaded_new_package, max_timestamp, total_downloads)
-
+  parser.add_argument('--days', type=int, default=1)
+  # By default, all downloads of the package in the log.
+  parser.add_argument('--total', type=int)
+  args = parser.parse_args()
 
+  max_timestamp = args.release + (args.days * 24 * 60 * 60)
+  count(args.package, max_timestamp, args.total, args.release)
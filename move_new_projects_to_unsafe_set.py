@@ -13,27 +13,7 @@ import os
 import sys
 
 # 2nd-party
-import changelog
-
-
-# The experiment is only valid since the following Unix timestamp.
-SINCE_TIMESTAMP = 1395360000
-UNTIL_TIMESTAMP = 1397952000
-
-
-class ChangeLogReader(changelog.ChangeLogReader):
-
-
-  def __init__(self, since, until):
-    super(ChangeLogReader, self).__init__(since, until)
-    self.new_packages = set()
-
-
-  def handle_create(self, change, action_match):
-    super(ChangeLogReader, self).handle_create(change, action_match)
-
-    name, version, timestamp, action, serial = change
-    self.new_packages.add(name)
+import project_table
 
 
 # This function will move the newly created projects from the safe set to the
@@ -45,12 +25,11 @@ def move(safe_packages, unsafe_packages):
   assert len(safe_packages & unsafe_packages) == 0
 
   # Data source 2: This is where we see developers creating/deleting projects,
-  # adding/deleting packages from their projects, and so on.
-  changelog_reader = ChangeLogReader(SINCE_TIMESTAMP, UNTIL_TIMESTAMP)
-  assert len(changelog_reader.new_packages) == 0
-  changelog_reader.read()
-  assert len(changelog_reader.new_packages) > 0
-  new_packages = changelog_reader.new_packages
+  # adding/deleting packages from their projects, and so on. The project table
+  # reads it once, instead of once for every partition.
+  table = project_table.load('created_in_window')
+  new_packages = table.get_names(table.created_in_window)
+  assert len(new_packages) > 0
 
   before_safe_packages_count = len(safe_packages)
   before_unsafe_packages_count = len(unsafe_packages)
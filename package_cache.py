@@ -15,6 +15,9 @@ import xmlrpc.client as xmlrpclib
 # sudo apt-get install python3-bs4
 from bs4 import BeautifulSoup
 
+# 2nd-party
+import checkpoint
+
 
 def get_last_timestamp_before_compromise(timestamps, compromise_timestamp):
   last_timestamp_before_compromise = None
@@ -95,13 +98,24 @@ class pypi_database_builder:
     return timestamps
 
 
-  def build(self):
-    projects = xmlrpclib.ServerProxy('https://pypi.python.org/pypi')\
-                        .list_packages()
-    failure_counter = 0
-    success_counter = 0
+  # Given a checkpoint, resumes with the same projects, after the last project
+  # dumped.
+  def build(self, progress=None):
+    if progress:
+      projects = progress.get('projects')
+      position = progress.get('position')
+      failure_counter = progress.get('failure_counter')
+      success_counter = progress.get('success_counter')
+      logging.info('Resuming from project #{}'.format(position))
+
+    else:
+      projects = xmlrpclib.ServerProxy('https://pypi.python.org/pypi')\
+                          .list_packages()
+      position = 0
+      failure_counter = 0
+      success_counter = 0
 
-    for project in projects:
+    for position, project in enumerate(projects[position:], position):
       if self.rebuild_cache or project not in self.project_to_package_timestamps:
         try:
           url = 'https://warehouse.python.org/project/{}/'.format(project)
@@ -125,6 +139,10 @@ class pypi_database_builder:
             logging.debug('Sleeping for 5 seconds... ({}% complete)'\
                           .format(progress_rate))
             self.dump()
+            if progress is not None:
+              progress.save(projects=projects, position=position+1,
+                            failure_counter=failure_counter,
+                            success_counter=success_counter)
             time.sleep(5)
 
     counter = failure_counter+success_counter
@@ -136,6 +154,9 @@ class pypi_database_builder:
     logging.info(failure_message)
     self.dump()
 
+    if progress is not None:
+      progress.remove()
+
 
   def dump(self):
     with open(self.filename, 'wt') as fp:
@@ -155,6 +176,8 @@ if __name__ == '__main__':
 
   cache = pypi_database_builder('/var/experiments-output/package_cache.json',
                                 rebuild_cache=True)
-  cache.build()
+  progress = \
+    checkpoint.Checkpoint('/var/experiments-output/package_cache.checkpoint')
+  cache.build(progress)
 
 
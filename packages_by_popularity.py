@@ -3,15 +3,19 @@
 
 # 1st-party
 import collections
-import csv
 import json
 import logging
 import os
 import sys
 
+# 3rd-party
+import numpy
+
 # 2nd-party
+import event_store
 import package_cache
-import translation_cache
+import request_cube
+import simple_log
 
 # Data source 3: A map of a project to the date (not time) of when it last
 # added, updated or removed a package.
@@ -24,7 +28,12 @@ SINCE_TIMESTAMP = 1395360000
 
 # this script will traverse the filename in the format of sorted.simple.log
 # and count the instances of every package request that occurred. 
-def sort_packages_by_popularity(filename):
+# If since or until is not None, count only requests where
+# since <= timestamp < until, reading only the partitions that hold them.
+# The log may also be an event store, which is counted with arrays.
+# Windows of whole hours are counted from the request cube of the log instead,
+# but only if it was already built (with request_cube.py), and is up to date.
+def sort_packages_by_popularity(filename, since=None, until=None):
   packages = collections.Counter()
 
   # Zero counters for all projects estimated to exist before compromise.
@@ -52,14 +61,31 @@ def sort_packages_by_popularity(filename):
   # Now count the popularity of packages that were actually downloaded.
   # NOTE: This is extremely biased towards the compromise period, but we have
   # no better data. Must note in paper.
-  with open(filename, 'rt') as simple_log:
-    requests = csv.reader(simple_log)
-
-    for timestamp, anonymized_ip, request, user_agent in requests:
-      package_name = translation_cache.infer_package_name(request)
-      assert package_name
-      assert len(package_name) > 0, request
-      packages[package_name] += 1
+  if request_cube.can_count(since, until) and \
+     request_cube.is_up_to_date(filename):
+    cube = request_cube.RequestCube(request_cube.get_cube_directory(filename))
+    project_counts = cube.get_project_counts(since, until)
+
+    for package_name, count in project_counts.items():
+      assert len(package_name) > 0
+      packages[package_name] += count
+
+  elif event_store.is_event_store(filename):
+    store = event_store.EventStore(filename)
+    projects = store.get_strings('projects')
+    project_ids = store.select(since, until).project_ids
+    counts = numpy.bincount(project_ids, minlength=len(projects))
+
+    for project_id in numpy.flatnonzero(counts):
+      package_name = projects[project_id]
+      assert len(package_name) > 0, project_id
+      packages[package_name] += int(counts[project_id])
+
+  else:
+    for batch in simple_log.read_batches(filename, since, until,
+                                         projects=True):
+      assert all(batch.projects)
+      packages.update(batch.projects)
 
   # order the dictionary
   logging.info('total # projects seen to exist after compromise: {:,}'\
@@ -0,0 +1,27 @@
+'''
+Helpers to farm work out to a pool of processes without losing the order of
+the input.
+'''
+
+
+# 1st-party
+import collections
+
+
+def map_in_order(pool, function, argss, window):
+  # Like Pool.imap, except that at most window results are pending at any time,
+  # so that a fast reader cannot queue a whole log in memory.
+  if pool is None:
+    for args in argss:
+      yield function(*args)
+
+  else:
+    pending = collections.deque()
+
+    for args in argss:
+      pending.append(pool.apply_async(function, args))
+      if len(pending) >= window:
+        yield pending.popleft().get()
+
+    while pending:
+      yield pending.popleft().get()
@@ -7,45 +7,34 @@ import logging
 import os
 import sys
 
+# 2nd-party
+import project_table
+
 
 OUTPUT_DIR = '/var/experiments-output/'
-# Data source 4: This list is expected to be in order of descending
-# popularity.
-PACKAGE_POPULARITY_FILENAME = os.path.join(OUTPUT_DIR,
-                                           'packages_by_popularity.txt')
 
 
 # This function returns a tuple of two sets, unsafe and safe, assuming that the
 # most popular packages are the ones that are secure.
 # The tuple returned will be of the form (safe, unsafe).
 def partition(fraction_of_claimed_packages):
-  packages_list = []
-  prev_count = None
-
   logging.info('{}% safe popular projects'\
                .format(fraction_of_claimed_packages*100))
 
-  with open(PACKAGE_POPULARITY_FILENAME, 'rt') as fp:
-    for line in fp:
-      package, count = line.split(',')
-
-      count = int(count)
-      assert count >= 0
-      if prev_count is None:
-        prev_count = count
-      assert prev_count >= count
-      prev_count = count
-
-      assert len(package) > 0
-      packages_list.append(package)
+  # Data source 4: The rank of every project, in order of descending
+  # popularity.
+  table = project_table.load('ranks')
+  ranked_projects = table.ranks >= 0
+  number_of_packages = int(ranked_projects.sum())
 
   assert fraction_of_claimed_packages >= 0
   assert fraction_of_claimed_packages <= 1
-  num_secure_packages = round(fraction_of_claimed_packages*len(packages_list))
+  num_secure_packages = round(fraction_of_claimed_packages*number_of_packages)
 
-  safe_packages = set(packages_list[:num_secure_packages])
-  unsafe_packages = set(packages_list[num_secure_packages:])
-  assert len(safe_packages) + len(unsafe_packages) == len(packages_list)
+  safe_packages = table.get_names(ranked_projects &
+                                  (table.ranks < num_secure_packages))
+  unsafe_packages = table.get_names(table.ranks >= num_secure_packages)
+  assert len(safe_packages) + len(unsafe_packages) == number_of_packages
   assert len(safe_packages & unsafe_packages) == 0
 
   logging.info('Safe popular projects: {:,}'.format(len(safe_packages)))
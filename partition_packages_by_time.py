@@ -10,13 +10,10 @@ import os
 import sys
 
 # 2nd-party
-import package_cache
+import project_table
 
 
 OUTPUT_DIR = '/var/experiments-output/'
-# Data source 3: A map of a project to the date (not time) of when it last
-# added, updated or removed a package.
-PACKAGE_LAST_MODIFIED_FILENAME = os.path.join(OUTPUT_DIR, 'package_cache.json')
 # The experiment is only valid since the following Unix timestamp.
 SINCE_TIMESTAMP = 1395360000
 SINCE_DATETIME = datetime.datetime.utcfromtimestamp(SINCE_TIMESTAMP)
@@ -42,8 +39,6 @@ def get_timestamp_before_compromise(time_delta):
 
 
 def partition(earliest_signing_of_claimed_projects_timedelta):
-  safe_packages, unsafe_packages = set(), set()
-
   earliest_signing_of_claimed_projects_timestamp = \
                               get_timestamp_before_compromise(
                                 earliest_signing_of_claimed_projects_timedelta)
@@ -58,26 +53,17 @@ def partition(earliest_signing_of_claimed_projects_timedelta):
                        earliest_signing_of_claimed_projects_timedelta,
                        SINCE_DATETIME))
 
-  with open(PACKAGE_LAST_MODIFIED_FILENAME, 'rt') as fp:
-    packages_list = json.load(fp)
-
-    for package in packages_list:
-      # Get timestamps of when the project added/updated/removed a package.
-      package_timestamps = packages_list[package]
-      # Get timestamp, if ANY, of when the project LAST added/updated/removed a
-      # package BEFORE the compromise.
-      package_timestamp = \
-        package_cache.get_last_timestamp_before_compromise(package_timestamps,
-                                                           SINCE_TIMESTAMP)
-
-      if package_timestamp:
-        if earliest_signing_of_claimed_projects_timestamp <= package_timestamp and \
-           package_timestamp < SINCE_TIMESTAMP:
-          safe_packages.add(package)
-        else:
-          unsafe_packages.add(package)
-      else:
-        unsafe_packages.add(package)
+  table = project_table.load('in_package_cache', 'last_timestamps')
+  last_timestamps = table.last_timestamps
+
+  # Projects that updated since the cutoff, but before compromise.
+  safe_projects = table.in_package_cache & (last_timestamps > 0) & \
+                  (earliest_signing_of_claimed_projects_timestamp <=
+                   last_timestamps) & \
+                  (last_timestamps < SINCE_TIMESTAMP)
+  unsafe_projects = table.in_package_cache & ~safe_projects
+  safe_packages = table.get_names(safe_projects)
+  unsafe_packages = table.get_names(unsafe_projects)
 
   assert len(safe_packages & unsafe_packages) == 0
   logging.info('Safe time-claimed projects: {:,}'.format(len(safe_packages)))
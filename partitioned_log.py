@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+'''
+A sorted simple log, split into one block log per UTC day (or hour) in a
+directory, with a catalog of the time bounds and number of lines of every
+partition:
+
+  DIRECTORY/catalog.json
+  DIRECTORY/2014-03-21.log.xz
+  DIRECTORY/2014-03-21.log.xz.index
+  ...
+
+Readers of a time range open only the partitions that overlap it, and, within
+those, decode only the blocks that overlap it. read_lines also reads plain
+(block) logs, so readers need not care which one they are given.
+
+USAGE: python3 partitioned_log.py [--granularity day|hour] [--codec CODEC]
+                                  SORTED_SIMPLE_LOG DIRECTORY
+Splits SORTED_SIMPLE_LOG into partitions in DIRECTORY.
+'''
+
+
+# 1st-party
+import argparse
+import codecs
+import csv
+import datetime
+import json
+import os
+
+# 2nd-party
+import block_log
+import compression
+
+
+CATALOG_FILENAME = 'catalog.json'
+
+# Seconds in every partition, and how to name it.
+GRANULARITIES = {'day': (24*60*60, '%Y-%m-%d'),
+                 'hour': (60*60, '%Y-%m-%dT%H')}
+DEFAULT_GRANULARITY = 'day'
+
+
+def get_catalog_filepath(directory):
+  return os.path.join(directory, CATALOG_FILENAME)
+
+
+def read_catalog(directory):
+  with open(get_catalog_filepath(directory), 'rt') as catalog_file:
+    return json.load(catalog_file)
+
+
+def write_catalog(directory, catalog):
+  catalog_filepath = get_catalog_filepath(directory)
+  temporary_filepath = catalog_filepath + '.tmp'
+
+  with open(temporary_filepath, 'wt') as catalog_file:
+    json.dump(catalog, catalog_file, sort_keys=True, indent=1)
+  os.replace(temporary_filepath, catalog_filepath)
+
+
+def get_last_timestamp(directory):
+  partitions = read_catalog(directory)['partitions']
+  if not partitions:
+    return None
+  return partitions[-1]['last_timestamp']
+
+
+class PartitionedLogWriter:
+
+
+  # To append, every line must come no earlier than the last line so far.
+  def __init__(self, directory, granularity=DEFAULT_GRANULARITY,
+               codec=compression.DEFAULT_CODEC,
+               block_size=block_log.BLOCK_SIZE, append=False):
+    self.directory = directory
+    self.codec = codec
+    self.block_size = block_size
+
+    if append:
+      self.catalog = read_catalog(directory)
+      assert self.catalog['codec'] == codec, self.catalog['codec']
+    else:
+      os.makedirs(directory, exist_ok=True)
+      self.catalog = {'granularity': granularity, 'codec': codec,
+                      'partitions': []}
+
+    self.seconds, self.name_format = \
+      GRANULARITIES[self.catalog['granularity']]
+
+    # The partition being written.
+    self.partition = None
+    self.block_log_writer = None
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+
+  # Lines must be given in order of time.
+  def write(self, line):
+    timestamp = block_log.get_timestamp(line)
+
+    if self.partition is None or timestamp >= self.partition['stop']:
+      self.open_partition(timestamp - timestamp % self.seconds)
+
+    self.block_log_writer.write(line)
+    self.partition['lines'] += 1
+    if self.partition['first_timestamp'] is None:
+      self.partition['first_timestamp'] = timestamp
+    self.partition['last_timestamp'] = timestamp
+
+
+  def open_partition(self, start):
+    self.close_partition()
+    partitions = self.catalog['partitions']
+
+    # Only the last partition may be appended to.
+    if partitions and partitions[-1]['start'] == start:
+      self.partition = partitions[-1]
+      append = True
+
+    else:
+      assert not partitions or partitions[-1]['start'] < start
+      name = datetime.datetime.utcfromtimestamp(start)\
+                              .strftime(self.name_format)
+      filename = '{}.log{}'.format(name, compression.EXTENSIONS[self.codec])
+      self.partition = {
+        'filename': filename,
+        'start': start,
+        'stop': start + self.seconds,
+        'first_timestamp': None,
+        'last_timestamp': None,
+        'lines': 0,
+      }
+      partitions.append(self.partition)
+      append = False
+
+    partition_filepath = os.path.join(self.directory,
+                                      self.partition['filename'])
+    self.block_log_writer = block_log.BlockLogWriter(partition_filepath,
+                                                     self.codec,
+                                                     self.block_size, append)
+
+
+  def close_partition(self):
+    if self.block_log_writer is not None:
+      self.block_log_writer.close()
+      self.block_log_writer = None
+
+
+  def close(self):
+    self.close_partition()
+    write_catalog(self.directory, self.catalog)
+
+
+# The partitions that overlap [since, until), and the time range to read from
+# each of them: None where the whole partition lies within the time range.
+def select_partitions(directory, since=None, until=None):
+  for partition in read_catalog(directory)['partitions']:
+    if (since is None or since <= partition['last_timestamp']) and \
+       (until is None or partition['first_timestamp'] < until):
+      # No need to filter partitions that lie within the time range.
+      if since is not None and since <= partition['first_timestamp']:
+        partition_since = None
+      else:
+        partition_since = since
+      if until is not None and partition['last_timestamp'] < until:
+        partition_until = None
+      else:
+        partition_until = until
+
+      partition_filepath = os.path.join(directory, partition['filename'])
+      yield partition_filepath, partition_since, partition_until
+
+
+def read_lines(filepath, since=None, until=None, jobs=1):
+  '''
+  parameters:
+    filepath:
+      either a directory of partitions, or a single (block) log.
+    since, until:
+      if not None, yield only lines where since <= timestamp < until.
+    jobs:
+      number of processes that decode blocks in parallel.
+
+  return:
+    A generator of lines, as bytes, in order of time.
+  '''
+
+  if not os.path.isdir(filepath):
+    yield from block_log.read_lines(filepath, since, until, jobs)
+    return
+
+  for partition_filepath, partition_since, partition_until in \
+      select_partitions(filepath, since, until):
+    yield from block_log.read_lines(partition_filepath, partition_since,
+                                    partition_until, jobs)
+
+
+# Like read_lines, but blocks of whole lines, as bytes, some of which may lie
+# outside [since, until) at the edges of the time range.
+def read_blocks(filepath, since=None, until=None, jobs=1):
+  if not os.path.isdir(filepath):
+    yield from block_log.read_blocks(filepath, since, until, jobs)
+    return
+
+  for partition_filepath, partition_since, partition_until in \
+      select_partitions(filepath, since, until):
+    yield from block_log.read_blocks(partition_filepath, partition_since,
+                                     partition_until, jobs)
+
+
+# (timestamp, ip_address, url, user_agent) rows, as strings.
+def read_rows(filepath, since=None, until=None, jobs=1):
+  return csv.reader(codecs.iterdecode(read_lines(filepath, since, until, jobs),
+                                      'utf-8'))
+
+
+if __name__ == '__main__':
+  # rw for owner and group but not others
+  os.umask(0o07)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--granularity', default=DEFAULT_GRANULARITY,
+                      choices=sorted(GRANULARITIES))
+  parser.add_argument('--codec', default=compression.DEFAULT_CODEC,
+                      choices=compression.CODECS)
+  parser.add_argument('--block-size', type=int, default=block_log.BLOCK_SIZE)
+  parser.add_argument('filepath')
+  parser.add_argument('directory')
+  args = parser.parse_args()
+
+  with PartitionedLogWriter(args.directory, args.granularity, args.codec,
+                            args.block_size) as partitioned_log_writer:
+    for line in block_log.read_lines(args.filepath):
+      partitioned_log_writer.write(line)
+
+  for partition in partitioned_log_writer.catalog['partitions']:
+    print('W {} ({:,} lines)'.format(os.path.join(args.directory,
+                                                  partition['filename']),
+                                     partition['lines']))
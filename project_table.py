@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+'''
+A table of facts about every project, as dense NumPy arrays indexed by the
+project ids of string_ids, so that joining a download with the facts about
+its project is one array index:
+
+  canonical_ids      int32: id of the name that PyPI redirects to, if any
+  ranks              int32: rank by popularity, from 0; -1 if unranked
+  last_timestamps    int64: last update before SINCE_TIMESTAMP; 0 if none
+  first_timestamps   int64: first update ever; 0 if none, or no timestamps
+  created_in_window  bool: whether created in [SINCE_TIMESTAMP, UNTIL_TIMESTAMP)
+  in_package_cache   bool: whether package_cache.json knows the project
+
+Every column is built from its own source (package_cache.json, the changelog,
+the popularity file, or the translation cache), and is left at its default if
+the source does not exist. The table is built again whenever a source changes,
+appears or disappears; tools load it with the columns they need, which must
+have their sources.
+
+USAGE: python3 project_table.py
+'''
+
+
+# 1st-party
+import functools
+import json
+import logging
+import os
+
+# 3rd-party
+import numpy
+
+# 2nd-party
+import changelog
+import package_cache
+import string_ids
+import translation_cache
+
+
+OUTPUT_DIR = '/var/experiments-output/'
+PROJECT_TABLE_DIRECTORY = os.path.join(OUTPUT_DIR, 'project_table')
+# Data source 3: A map of a project to the date (not time) of when it last
+# added, updated or removed a package.
+PACKAGE_LAST_MODIFIED_FILENAME = os.path.join(OUTPUT_DIR, 'package_cache.json')
+# Data source 4: This list is expected to be in order of descending
+# popularity.
+PACKAGE_POPULARITY_FILENAME = os.path.join(OUTPUT_DIR,
+                                           'packages_by_popularity.txt')
+
+# The experiment is only valid since the following Unix timestamp.
+SINCE_TIMESTAMP = 1395360000
+UNTIL_TIMESTAMP = 1397952000
+
+# column: dtype
+COLUMNS = (
+  ('canonical_ids', 'int32'),
+  ('ranks', 'int32'),
+  ('last_timestamps', 'int64'),
+  ('first_timestamps', 'int64'),
+  ('created_in_window', 'bool'),
+  ('in_package_cache', 'bool'),
+)
+
+# source filepath: mtime (or None if missing), as of the last build
+SOURCES_FILENAME = 'sources.json'
+
+
+class ChangeLogReader(changelog.ChangeLogReader):
+
+
+  def __init__(self, since, until):
+    super(ChangeLogReader, self).__init__(since, until)
+    self.new_packages = set()
+
+
+  def handle_create(self, change, action_match):
+    super(ChangeLogReader, self).handle_create(change, action_match)
+
+    name, version, timestamp, action, serial = change
+    self.new_packages.add(name)
+
+
+CHANGELOG_FILENAME = \
+  changelog.CHANGELOG_FILENAME.format(since=SINCE_TIMESTAMP,
+                                      until=UNTIL_TIMESTAMP)
+
+# column: the source it is built from
+COLUMN_SOURCES = {
+  'canonical_ids': translation_cache.TRANSLATION_CACHE_FILENAME,
+  'ranks': PACKAGE_POPULARITY_FILENAME,
+  'last_timestamps': PACKAGE_LAST_MODIFIED_FILENAME,
+  'first_timestamps': PACKAGE_LAST_MODIFIED_FILENAME,
+  'created_in_window': CHANGELOG_FILENAME,
+  'in_package_cache': PACKAGE_LAST_MODIFIED_FILENAME,
+}
+
+
+def get_sources():
+  return (PACKAGE_LAST_MODIFIED_FILENAME,
+          PACKAGE_POPULARITY_FILENAME,
+          translation_cache.TRANSLATION_CACHE_FILENAME,
+          CHANGELOG_FILENAME)
+
+
+def get_source_mtimes():
+  return {source: os.path.getmtime(source) if os.path.exists(source) else None
+          for source in get_sources()}
+
+
+def get_column_filepath(directory, column):
+  return os.path.join(directory, column + '.npy')
+
+
+# Project names, in order of descending popularity.
+def read_popularity(filename=PACKAGE_POPULARITY_FILENAME):
+  packages_list = []
+  prev_count = None
+
+  with open(filename, 'rt') as fp:
+    for line in fp:
+      package, count = line.split(',')
+
+      count = int(count)
+      assert count >= 0
+      if prev_count is None:
+        prev_count = count
+      assert prev_count >= count
+      prev_count = count
+
+      assert len(package) > 0
+      packages_list.append(package)
+
+  return packages_list
+
+
+# Projects created in the changelog during the experiment.
+def read_new_projects():
+  changelog_reader = ChangeLogReader(SINCE_TIMESTAMP, UNTIL_TIMESTAMP)
+  assert len(changelog_reader.new_packages) == 0
+  changelog_reader.read()
+  assert len(changelog_reader.new_packages) > 0
+  return changelog_reader.new_packages
+
+
+def build(directory=PROJECT_TABLE_DIRECTORY,
+          dictionary_directory=string_ids.DIRECTORY):
+  source_mtimes = get_source_mtimes()
+
+  # Missing sources are as good as empty.
+  if source_mtimes[PACKAGE_LAST_MODIFIED_FILENAME] is None:
+    packages_list = {}
+  else:
+    with open(PACKAGE_LAST_MODIFIED_FILENAME, 'rt') as fp:
+      packages_list = json.load(fp)
+
+  if source_mtimes[PACKAGE_POPULARITY_FILENAME] is None:
+    popular_packages = []
+  else:
+    popular_packages = read_popularity()
+
+  if source_mtimes[CHANGELOG_FILENAME] is None:
+    new_packages = set()
+  else:
+    new_packages = read_new_projects()
+
+  translations = \
+    translation_cache.pypi_translation_cache().translation_dict
+
+  projects = string_ids.load('projects', dictionary_directory)
+  for package in packages_list:
+    projects.get_id(package)
+  for package in popular_packages:
+    projects.get_id(package)
+  for package in new_packages:
+    projects.get_id(package)
+  for package, translated_package in translations.items():
+    projects.get_id(package)
+    if translated_package:
+      projects.get_id(translated_package)
+  projects.save()
+
+  length = len(projects)
+  table = {
+    'canonical_ids': numpy.arange(length, dtype='int32'),
+    'ranks': numpy.full(length, -1, dtype='int32'),
+    'last_timestamps': numpy.zeros(length, dtype='int64'),
+    'first_timestamps': numpy.zeros(length, dtype='int64'),
+    'created_in_window': numpy.zeros(length, dtype='bool'),
+    'in_package_cache': numpy.zeros(length, dtype='bool'),
+  }
+
+  for package, timestamps in packages_list.items():
+    project_id = projects.find(package)
+    table['in_package_cache'][project_id] = True
+
+    if timestamps:
+      table['first_timestamps'][project_id] = min(timestamps)
+    timestamp = \
+      package_cache.get_last_timestamp_before_compromise(timestamps,
+                                                         SINCE_TIMESTAMP)
+    if timestamp:
+      assert timestamp < SINCE_TIMESTAMP
+      table['last_timestamps'][project_id] = timestamp
+
+  for rank, package in enumerate(popular_packages):
+    project_id = projects.find(package)
+    assert table['ranks'][project_id] == -1, package
+    table['ranks'][project_id] = rank
+
+  for package in new_packages:
+    table['created_in_window'][projects.find(package)] = True
+
+  for package, translated_package in translations.items():
+    if translated_package:
+      table['canonical_ids'][projects.find(package)] = \
+        projects.find(translated_package)
+
+  os.makedirs(directory, exist_ok=True)
+  for column, dtype in COLUMNS:
+    numpy.save(get_column_filepath(directory, column), table[column])
+
+  with open(os.path.join(directory, SOURCES_FILENAME), 'wt') as sources_file:
+    json.dump(source_mtimes, sources_file, sort_keys=True, indent=1)
+
+  logging.info('W {} ({:,} projects)'.format(directory, length))
+
+
+def is_up_to_date(directory):
+  sources_filepath = os.path.join(directory, SOURCES_FILENAME)
+  if not os.path.exists(sources_filepath):
+    return False
+
+  with open(sources_filepath, 'rt') as sources_file:
+    return json.load(sources_file) == get_source_mtimes()
+
+
+class ProjectTable:
+
+
+  def __init__(self, directory=PROJECT_TABLE_DIRECTORY,
+               dictionary_directory=string_ids.DIRECTORY):
+    for column, dtype in COLUMNS:
+      setattr(self, column, numpy.load(get_column_filepath(directory, column)))
+    self.projects = string_ids.load('projects', dictionary_directory)
+
+    with open(os.path.join(directory, SOURCES_FILENAME), 'rt') as \
+                                                              sources_file:
+      self.source_mtimes = json.load(sources_file)
+
+
+  # Columns whose sources were missing hold only defaults, which must not be
+  # mistaken for facts.
+  def require(self, columns):
+    for column in columns:
+      source = COLUMN_SOURCES[column]
+      if self.source_mtimes.get(source) is None:
+        raise FileNotFoundError('{} needs {}'.format(column, source))
+
+
+  def __len__(self):
+    return len(self.ranks)
+
+
+  # The id of every project name, or -1 if the table does not know it.
+  def get_ids(self, project_names):
+    project_ids = numpy.fromiter((self.projects.ids.get(project_name, -1)
+                                  for project_name in project_names),
+                                 dtype='int32', count=len(project_names))
+    # Projects that got ids after the table was built.
+    project_ids[project_ids >= len(self)] = -1
+    return project_ids
+
+
+  # The names of the projects where the boolean array is true.
+  def get_names(self, mask):
+    return set(self.projects[project_id]
+               for project_id in numpy.flatnonzero(mask).tolist())
+
+
+# Build the table only once, and only if a source changed since. The given
+# columns must be built from their sources.
+@functools.lru_cache(maxsize=None)
+def load(*columns, directory=PROJECT_TABLE_DIRECTORY,
+         dictionary_directory=string_ids.DIRECTORY):
+  if not is_up_to_date(directory):
+    build(directory, dictionary_directory)
+
+  table = ProjectTable(directory, dictionary_directory)
+  table.require(columns)
+  return table
+
+
+if __name__ == '__main__':
+  # rw for owner and group but not others
+  os.umask(0o07)
+
+  logging.basicConfig(level=logging.INFO)
+  build()
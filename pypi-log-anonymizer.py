@@ -2,60 +2,145 @@
 
 '''
 A little script to anonymize IP addresses in log files.
+
+Logs are anonymized in chunks by a pool of worker processes. Plain logs are cut
+into byte ranges that every worker reads for itself, whereas gzipped logs
+cannot be seeked, so they are cut into blocks of lines by the parent. Lines are
+rewritten as raw bytes, and every chunk is compressed into its own xz (or
+otherwise) stream. The streams are written in the order of the input, so that
+the concatenation is one valid compressed file.
 '''
 
 
 # 1st-party
-import gzip
-import hashlib
-import lzma
-import mimetypes
+import argparse
+import itertools
+import multiprocessing
 import os
-import sys
-
-
-# Fixed-length columns on each line must be delimited by this string.
-DELIMITER = ' '
-
-# Random fixed-salt we never store anywhere
-SALT = os.urandom(256)
-
 
-def anonymize(message):
-  # http://stackoverflow.com/a/7585378
-  encoded_messsage = message.encode('utf-8')
-  return hashlib.sha256(SALT + encoded_messsage).hexdigest()
+# 2nd-party
+import anonymization
+import compression
+import parallel
+
+
+# Reused by every chunk that a process anonymizes.
+OUTPUT_BUFFER = bytearray()
+
+
+def anonymize_chunk(chunk, ip_field_index, codec):
+  # A chunk is either a byte range of a plain log, or a block of lines.
+  if isinstance(chunk, tuple):
+    block = anonymization.read_byte_range(*chunk)
+  else:
+    block = chunk
+
+  # Report how this chunk used the digest cache of whichever worker ran it.
+  before = anonymization.anonymize_cached.cache_info()
+  anonymization.anonymize_block(block, ip_field_index, OUTPUT_BUFFER)
+  after = anonymization.anonymize_cached.cache_info()
+
+  # Every chunk is compressed, in one call, into its own xz stream.
+  # Concatenated xz streams are themselves a valid xz file, so chunks need only
+  # be written in order. The same goes for the other codecs.
+  compressed_chunk = compression.compress(OUTPUT_BUFFER, codec)
+  del OUTPUT_BUFFER[:]
+
+  return compressed_chunk, after.hits-before.hits, after.misses-before.misses
+
+
+def get_chunks(filepath, chunk_size=anonymization.BLOCK_SIZE):
+  if compression.detect_codec(filepath) != 'none':
+    with compression.open(filepath, 'rb') as file_in:
+      yield from anonymization.read_blocks(file_in, chunk_size)
+
+  else:
+    filepath_size = os.path.getsize(filepath)
+    for start in range(0, filepath_size, chunk_size):
+      yield filepath, start, min(start+chunk_size, filepath_size)
+
+
+def anonymize_files(filepaths, ip_field_index, jobs, hash_algorithm='sha256',
+                    cache_size=anonymization.CACHE_SIZE,
+                    codec=compression.DEFAULT_CODEC):
+  # Tasks from every file flow through the same pool, so that the workers do
+  # not sit idle at the end of each file.
+  def get_tasks():
+    for filepath in filepaths:
+      anonymized_compressed_filepath = \
+        'anonymized.' + filepath + compression.EXTENSIONS[codec]
+      for chunk in get_chunks(filepath):
+        yield anonymized_compressed_filepath, chunk
+
+  # Every worker must use the same salt as the parent, or else the same IP
+  # address would be hashed differently depending on which worker saw it.
+  hash_args = (anonymization.SALT, hash_algorithm, cache_size)
+
+  if jobs > 1:
+    pool = multiprocessing.Pool(jobs, initializer=anonymization.init_hash,
+                                initargs=hash_args)
+  else:
+    anonymization.init_hash(*hash_args)
+    pool = None
+
+  tasks1, tasks2 = itertools.tee(get_tasks())
+  argss = ((chunk, ip_field_index, codec) for filepath, chunk in tasks1)
+  results = parallel.map_in_order(pool, anonymize_chunk, argss, window=jobs*2)
+  file_out = None
+  cache_hits, cache_misses = 0, 0
+
+  def close(file_out):
+    file_out.close()
+    print('W ' + file_out.name)
+    cache_lookups = cache_hits + cache_misses
+    if cache_lookups > 0:
+      cache_hit_rate = (cache_hits / cache_lookups) * 100
+      print('Digest cache hit rate: {:.2f}%'.format(cache_hit_rate))
+
+  try:
+    for (anonymized_compressed_filepath, chunk), \
+        (compressed_chunk, chunk_hits, chunk_misses) in zip(tasks2, results):
+      if file_out is None or file_out.name != anonymized_compressed_filepath:
+        if file_out is not None:
+          close(file_out)
+          cache_hits, cache_misses = 0, 0
+        file_out = open(anonymized_compressed_filepath, 'wb')
+
+      file_out.write(compressed_chunk)
+      cache_hits += chunk_hits
+      cache_misses += chunk_misses
+
+  finally:
+    if file_out is not None:
+      close(file_out)
+
+    if pool is not None:
+      pool.close()
+      pool.join()
 
 
 if __name__ == '__main__':
-  # USAGE: python3 anonymizer.py IP_FIELD_INDEX IN1-.LOG IN-2.LOG ... IN-N.LOG
-  assert len(sys.argv) >= 3
-  ip_field_index = int(sys.argv[1])
-  filepaths = sys.argv[2:]
-
-  assert ip_field_index >= 0
+  # USAGE: python3 anonymizer.py [-j JOBS] IP_FIELD_INDEX IN1-.LOG ... IN-N.LOG
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                      help='Number of worker processes')
+  parser.add_argument('--hash', default='sha256',
+                      choices=anonymization.HASH_ALGORITHMS,
+                      help='Use blake2b only for new datasets')
+  parser.add_argument('--codec', default=compression.DEFAULT_CODEC,
+                      choices=compression.CODECS)
+  parser.add_argument('--cache-size', type=int,
+                      default=anonymization.CACHE_SIZE,
+                      help='Number of IP address digests to remember')
+  parser.add_argument('ip_field_index', type=int)
+  parser.add_argument('filepaths', nargs='+')
+  args = parser.parse_args()
+
+  assert args.ip_field_index >= 0
+  assert args.jobs >= 1
 
   # rw for owner and group but not others
-  os.umask(007)
-
-  for filepath in filepaths:
-    filepath_type, filepath_encoding = mimetypes.guess_type(filepath)
-    anonymized_compressed_filepath = 'anonymized.' + filepath + '.xz'
-
-    if filepath_encoding == 'gzip':
-      filepath_open = gzip.open
-
-    else:
-      filepath_open = open
-
-    with filepath_open(filepath, 'rt') as file_in, \
-         lzma.open(anonymized_compressed_filepath, 'w') as file_out:
-      for line in file_in:
-        tokens = line.split(DELIMITER)
-        tokens[ip_field_index] = anonymize(tokens[ip_field_index])
-        replaced_line = DELIMITER.join(tokens)
-        # http://stackoverflow.com/a/5471351
-        replaced_line_as_bytes = bytes(replaced_line, 'utf-8')
-        file_out.write(replaced_line_as_bytes)
+  os.umask(0o07)
 
-    print('W ' + anonymized_compressed_filepath)
+  anonymize_files(args.filepaths, args.ip_field_index, args.jobs, args.hash,
+                  args.cache_size, args.codec)
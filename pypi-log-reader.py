@@ -8,11 +8,10 @@ TODO:
 
 
 # 1st-party
+import array
 import collections
-import csv
 import datetime
 import logging
-import lzma
 import os
 import re
 import sys
@@ -26,6 +25,11 @@ matplotlib.use('Agg')
 import matplotlib.pyplot
 import numpy
 
+# 2nd-party
+import event_store
+import simple_log
+import string_ids
+
 
 class SortedSimplePyPILogReader:
   EPSILON = ''
@@ -36,39 +40,133 @@ class SortedSimplePyPILogReader:
 
   PROJECT_URL_REGEX = re.compile(r'^/packages/(.+)/(.+)/(.+)/(.+)$')
 
-
-  def __init__(self):
-    # ip_address: set(project_name)
-    self.ip_address_projects = {}
-    # ip_address: request_count
+  # Deduplicate (IP address, project) pairs every this many requests.
+  PAIR_BUFFER_SIZE = 16*1024*1024
+
+
+  # IP addresses and projects are kept as their ids in the shared dictionaries
+  # of string_ids. New strings get new ids in the shared dictionaries, too.
+  def __init__(self, dictionary_directory=string_ids.DIRECTORY):
+    self.dictionary_directory = dictionary_directory
+    self.ip_addresses = string_ids.load('ip_addresses', dictionary_directory)
+    self.projects = string_ids.load('projects', dictionary_directory)
+
+    # Every distinct (ip_address_id, project_id) pair seen, packed into one
+    # int64, sorted, and those not yet merged into them.
+    self.ip_address_project_pairs = numpy.zeros(0, dtype=numpy.int64)
+    self.new_ip_address_project_pairs = array.array('q')
+    # Once parsing finishes, the pairs as posting lists: the project ids of
+    # ip_address_ids[i] are project_id_deltas[offsets[i]:offsets[i+1]],
+    # sorted, and delta-encoded.
+    self.ip_address_ids = None
+    self.project_offsets = None
+    self.project_id_deltas = None
+    # ip_address_id: request_count
     self.ip_address_requests = collections.Counter()
-    # project_name: request_count
+    # project_id: request_count
     self.package_requests = collections.Counter()
 
     self.oldest_timestamp = 0
     self.previous_timestamp = 0
 
-  def parse(self, sorted_simple_log_filepath):
-    with lzma.open(sorted_simple_log_filepath, 'rt') as sorted_simple_log_file:
-      sorted_simple_log_file = csv.reader(sorted_simple_log_file)
-      for line in sorted_simple_log_file:
-        unix_timestamp, ip_address, url, user_agent = line
-        unix_timestamp = int(unix_timestamp)
-
-        assert self.previous_timestamp <= unix_timestamp
-
-        pyversion, alphabet, project_name, package_name = \
-                        SortedSimplePyPILogReader.PROJECT_URL_REGEX.match(url)
-        project_name = project_name.strip(SortedSimplePyPILogReader.SLASH)
-        assert SortedSimplePyPILogReader.SLASH not in project_name
-
-        self.package_requests[project_name] += 1
-
-        self.oldest_timestamp = self.oldest_timestamp or unix_timestamp
-        self.previous_timestamp = unix_timestamp
-        self.ip_address_requests[ip_address] += 1
-        self.ip_address_projects.setdefault(ip_address, set())\
-                                .add(project_name)
+  # Parse only requests where since <= timestamp < until, decoding the blocks
+  # of the log (or of the partitions that hold them) with this many processes.
+  # The log may also be an event store, which is parsed with arrays.
+  def parse(self, sorted_simple_log_filepath, since=None, until=None, jobs=1):
+    assert self.project_offsets is None, 'cannot parse after summarizing'
+
+    if event_store.is_event_store(sorted_simple_log_filepath):
+      self.parse_event_store(sorted_simple_log_filepath, since, until)
+      return
+
+    for batch in simple_log.read_batches(sorted_simple_log_filepath, since,
+                                         until, jobs, projects=True):
+      assert self.previous_timestamp <= batch.timestamps[0]
+      self.oldest_timestamp = self.oldest_timestamp or batch.timestamps[0]
+      self.previous_timestamp = batch.timestamps[-1]
+
+      project_ids = list(map(self.projects.get_id, batch.projects))
+      ip_address_ids = list(map(self.ip_addresses.get_id,
+                                batch.ip_addresses))
+      self.package_requests.update(project_ids)
+      self.ip_address_requests.update(ip_address_ids)
+
+      self.new_ip_address_project_pairs.extend(
+        (ip_address_id << 32) | project_id
+        for ip_address_id, project_id in zip(ip_address_ids, project_ids))
+      if len(self.new_ip_address_project_pairs) >= \
+         SortedSimplePyPILogReader.PAIR_BUFFER_SIZE:
+        self.merge_ip_address_project_pairs()
+
+    # Append the last new ids, and let go of the dictionaries.
+    self.projects.save()
+    self.ip_addresses.save()
+
+
+  # The ids of the event store are those of the shared dictionaries.
+  def parse_event_store(self, event_store_directory, since=None, until=None):
+    store = event_store.EventStore(event_store_directory,
+                                   dictionary_directory=\
+                                     self.dictionary_directory)
+    events = store.select(since, until)
+    if len(events.timestamps) == 0:
+      return
+
+    assert self.previous_timestamp <= events.timestamps[0]
+    self.oldest_timestamp = self.oldest_timestamp or int(events.timestamps[0])
+    self.previous_timestamp = int(events.timestamps[-1])
+
+    package_requests = numpy.bincount(events.project_ids)
+    for project_id in numpy.flatnonzero(package_requests).tolist():
+      self.package_requests[project_id] += int(package_requests[project_id])
+
+    ip_address_requests = numpy.bincount(events.ip_address_ids)
+    for ip_address_id in numpy.flatnonzero(ip_address_requests).tolist():
+      self.ip_address_requests[ip_address_id] += \
+        int(ip_address_requests[ip_address_id])
+
+    # Every distinct (IP address, project) pair, packed into one integer.
+    pairs = numpy.unique((events.ip_address_ids.astype(numpy.int64) << 32) |
+                         events.project_ids)
+    self.ip_address_project_pairs = \
+      numpy.union1d(self.ip_address_project_pairs, pairs)
+
+
+  def merge_ip_address_project_pairs(self):
+    new_pairs = numpy.frombuffer(self.new_ip_address_project_pairs,
+                                 dtype=numpy.int64)
+    self.ip_address_project_pairs = \
+      numpy.union1d(self.ip_address_project_pairs, new_pairs)
+    self.new_ip_address_project_pairs = array.array('q')
+
+
+  # Once parsing finishes, keep the pairs as delta-encoded posting lists.
+  def encode_ip_address_projects(self):
+    self.merge_ip_address_project_pairs()
+    pairs = self.ip_address_project_pairs
+    ip_address_ids = pairs >> 32
+    project_ids = pairs & 0xffffffff
+
+    # Pairs are sorted, so the posting list of every IP address is a run.
+    starts = numpy.flatnonzero(numpy.diff(ip_address_ids, prepend=-1))
+    deltas = numpy.diff(project_ids, prepend=0)
+    # The first project id of every posting list is itself.
+    deltas[starts] = project_ids[starts]
+
+    self.ip_address_ids = ip_address_ids[starts].astype(numpy.int32)
+    self.project_offsets = numpy.append(starts, len(pairs))\
+                                .astype(numpy.int64)
+    self.project_id_deltas = deltas.astype(numpy.int32)
+    self.ip_address_project_pairs = numpy.zeros(0, dtype=numpy.int64)
+
+
+  # The project ids of all posting lists, decoded at once.
+  def decode_project_ids(self):
+    project_ids = numpy.cumsum(self.project_id_deltas, dtype=numpy.int64)
+    starts = self.project_offsets[:-1]
+    # Subtract, from every posting list, the sum of the lists before it.
+    bases = project_ids[starts] - self.project_id_deltas[starts]
+    return project_ids - numpy.repeat(bases, numpy.diff(self.project_offsets))
 
 
   def plot_cumulative_client_curve(self, max_rank, num_of_num_of_requests):
@@ -153,13 +251,16 @@ class SortedSimplePyPILogReader:
       datetime.datetime.utcfromtimestamp(self.previous_timestamp)
     seconds_elapsed = self.previous_timestamp - self.oldest_timestamp
 
-    # [('project_name', num_of_requests), ...]
+    # [(project_id, num_of_requests), ...]
     package_requests = self.package_requests.most_common()
     num_of_package_requests_by_rank = [p[1] for p in package_requests]
     num_of_package_requests = sum(num_of_package_requests_by_rank)
 
-    pop_package_requests = package_requests[:max_rank]
-    pop_package_names = set(p[0] for p in pop_package_requests)
+    pop_package_ids = set(p[0] for p in package_requests[:max_rank])
+    # [('project_name', num_of_requests), ...]
+    pop_package_requests = [(self.projects[project_id], num_of_requests)
+                            for project_id, num_of_requests
+                            in package_requests[:max_rank]]
     num_of_pop_package_requests_by_rank = [p[1] for p in pop_package_requests]
     num_of_pop_package_requests = sum(num_of_pop_package_requests_by_rank)
 
@@ -196,21 +297,33 @@ class SortedSimplePyPILogReader:
     logging.info('')
 
     # number of times a number of requests is seen
-    for ip_address, ip_address_count in self.ip_address_requests.items():
+    for ip_address_id, ip_address_count in self.ip_address_requests.items():
       num_of_num_of_requests[ip_address_count] += 1
     logging.info('[(# of requests, # of times)]: {}'.\
                  format(num_of_num_of_requests))
     logging.info('')
 
-    num_of_users_who_request_unpopular_projects = 0
+    # Only once, since encoding forgets the pairs.
+    if self.project_offsets is None:
+      self.encode_ip_address_projects()
+    project_ids_counts = numpy.diff(self.project_offsets)
 
     # number of times a number of projects is seen
-    for ip_address, project_names in self.ip_address_projects.items():
-      project_names_count = len(project_names)
-      num_of_num_of_projects[project_names_count] += 1
-
-      if len(project_names - pop_package_names) > 0:
-        num_of_users_who_request_unpopular_projects += 1
+    project_ids_counts, num_of_times = \
+      numpy.unique(project_ids_counts, return_counts=True)
+    num_of_num_of_projects.update(dict(zip(project_ids_counts.tolist(),
+                                           num_of_times.tolist())))
+
+    # project_id: whether it is popular
+    popular_projects = numpy.zeros(len(self.projects), dtype=bool)
+    popular_projects[list(pop_package_ids)] = True
+    unpopular_requests = ~popular_projects[self.decode_project_ids()]
+    if len(unpopular_requests) > 0:
+      num_of_users_who_request_unpopular_projects = int(numpy.count_nonzero(
+        numpy.logical_or.reduceat(unpopular_requests,
+                                  self.project_offsets[:-1])))
+    else:
+      num_of_users_who_request_unpopular_projects = 0
 
     logging.info('[(# of projects, # of times)]: {}'.\
                  format(num_of_num_of_projects))
@@ -249,7 +362,8 @@ if __name__ == '__main__':
     '/var/experiments-output/simple/sorted.simple.log.xz'
   try:
     sorted_simple_pypi_log_reader = SortedSimplePyPILogReader()
-    sorted_simple_pypi_log_reader.parse(sorted_simple_log_filepath)
+    sorted_simple_pypi_log_reader.parse(sorted_simple_log_filepath,
+                                        jobs=os.cpu_count())
     sorted_simple_pypi_log_reader.summarize()
   except:
     logging.exception('BAM!')
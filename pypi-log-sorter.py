@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+
+'''
+Sorts simple logs by (timestamp, IP address, user agent, URL), without
+duplicates, into one sorted simple log, compressed in indexed blocks.
+
+An external merge sort: the simple logs are cut into runs that fit in the
+memory budget, which worker processes sort, deduplicate and write as
+compressed temporary files. Then, the runs are merged with heapq.merge, which
+drops the duplicates between runs, straight into a block_log.BlockLogWriter.
+Unlike GNU sort, fields are compared as bytes, whatever the locale.
+
+USAGE: python3 pypi-log-sorter.py [-j JOBS] [--memory-budget MB]
+                                  [--codec CODEC] [--append] [SIMPLE_LOG ...]
+Without SIMPLE_LOGs, sorts the simple logs that the stripper left in
+/var/experiments-output/anonymized/, and then removes them.
+
+To ingest new days, run the stripper with --ingest, which walks only the logs
+it has not walked before, and then the sorter with --append, which adds their
+lines to the end of the sorted log if they are all newer than it.
+'''
+
+
+# 1st-party
+import argparse
+import glob
+import heapq
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# 2nd-party
+import block_log
+import compression
+import parallel
+import partitioned_log
+
+
+SIMPLE_LOGS = '/var/experiments-output/anonymized/simple.*.log'
+SORTED_SIMPLE_LOG_FILEPATH = '/var/experiments-output/simple/sorted.simple.log'
+
+# All runs in memory at the same time, and their sort keys, must fit in this
+# many megabytes.
+MEMORY_BUDGET = 4*1024
+# A line and its sort key take about this many bytes more than its length.
+LINE_OVERHEAD = 320
+
+# Runs are temporary, so compress them for speed rather than size, or not at
+# all, rather than slowly, if zstd is not installed.
+RUN_CODEC = 'zstd' if compression.is_available('zstd') else 'none'
+
+
+# "unix_timestamp","ip_address","url","user_agent"\n
+# Neither IP addresses nor (quoted) URLs hold quotes, but user agents might.
+def get_key(line):
+  unix_timestamp, ip_address, url, user_agent = line[1:].split(b'","', 3)
+  # Without the closing quote and newline.
+  return int(unix_timestamp), ip_address, user_agent[:-2], url
+
+
+def read_runs(simple_log_filepaths, run_size):
+  run = []
+  size = 0
+
+  for simple_log_filepath in simple_log_filepaths:
+    with compression.open(simple_log_filepath, 'rb') as simple_log_file:
+      for line in simple_log_file:
+        # Or the last line of a file would not equal its duplicates.
+        if not line.endswith(b'\n'):
+          line += b'\n'
+
+        run.append(line)
+        size += len(line) + LINE_OVERHEAD
+
+        if size >= run_size:
+          yield run
+          run = []
+          size = 0
+
+  if run:
+    yield run
+
+
+# Runs in a worker process.
+def write_run(run, run_filepath, codec):
+  run.sort(key=get_key)
+  previous_line = None
+  write_counter = 0
+
+  with compression.open(run_filepath, 'wb', codec) as run_file:
+    for line in run:
+      if line != previous_line:
+        run_file.write(line)
+        write_counter += 1
+        previous_line = line
+
+  first_timestamp = get_key(run[0])[0]
+  return run_filepath, len(run), write_counter, first_timestamp
+
+
+# Either one block log, or, given a granularity, a directory of partitions.
+def open_writer(sorted_simple_log_filepath, codec, block_size,
+                granularity=None, append=False):
+  if granularity is None:
+    return block_log.BlockLogWriter(sorted_simple_log_filepath, codec,
+                                    block_size, append)
+  else:
+    return partitioned_log.PartitionedLogWriter(sorted_simple_log_filepath,
+                                                granularity, codec,
+                                                block_size, append)
+
+
+# Given the lines of a sorted log, merges them as well.
+def merge_runs(run_filepaths, writer, sorted_lines=()):
+  run_files = [compression.open(run_filepath, 'rb')
+               for run_filepath in run_filepaths]
+  previous_line = None
+  write_counter = 0
+
+  try:
+    with writer:
+      for line in heapq.merge(sorted_lines, *run_files, key=get_key):
+        if line != previous_line:
+          writer.write(line)
+          write_counter += 1
+          previous_line = line
+
+  finally:
+    for run_file in run_files:
+      run_file.close()
+
+  return write_counter
+
+
+# Whether lines that begin at first_timestamp can simply be added to the end of
+# a sorted log, without any chance of duplicating its lines.
+def can_append(sorted_simple_log_filepath, codec, first_timestamp):
+  if os.path.isdir(sorted_simple_log_filepath):
+    catalog = partitioned_log.read_catalog(sorted_simple_log_filepath)
+    if catalog['codec'] != codec:
+      return False
+    last_timestamp = \
+      partitioned_log.get_last_timestamp(sorted_simple_log_filepath)
+
+  else:
+    index = block_log.read_index(sorted_simple_log_filepath)
+    if index is None or index['codec'] != codec:
+      return False
+    last_timestamp = block_log.get_last_timestamp(sorted_simple_log_filepath)
+
+  return first_timestamp is None or last_timestamp is None or \
+         last_timestamp < first_timestamp
+
+
+def replace(merged_simple_log_filepath, sorted_simple_log_filepath):
+  if os.path.isdir(sorted_simple_log_filepath):
+    old_simple_log_filepath = sorted_simple_log_filepath + '.old'
+    os.rename(sorted_simple_log_filepath, old_simple_log_filepath)
+    os.rename(merged_simple_log_filepath, sorted_simple_log_filepath)
+    shutil.rmtree(old_simple_log_filepath)
+
+  else:
+    # Never leave the old index next to the new log, nor the new index next to
+    # the old log. In between, the log is read without an index.
+    index_filepath = block_log.get_index_filepath(sorted_simple_log_filepath)
+    if os.path.exists(index_filepath):
+      os.remove(index_filepath)
+    os.replace(merged_simple_log_filepath, sorted_simple_log_filepath)
+    os.replace(block_log.get_index_filepath(merged_simple_log_filepath),
+               index_filepath)
+
+
+# Given append, adds the simple logs to an existing sorted log, if any. Given a
+# granularity, the sorted log is a directory of partitions.
+def sort(simple_log_filepaths, sorted_simple_log_filepath,
+         memory_budget=MEMORY_BUDGET, jobs=1, codec=compression.DEFAULT_CODEC,
+         block_size=block_log.BLOCK_SIZE, run_codec=RUN_CODEC, append=False,
+         granularity=None):
+  # Without workers, only the run being sorted is in memory. With them, the
+  # run being read is, and every run in flight is in memory twice: as it was
+  # read (or its pickle), until it is sent, and as unpickled by its worker.
+  if jobs > 1:
+    run_size = (memory_budget*1024*1024) // (2*jobs+1)
+  else:
+    run_size = memory_budget*1024*1024
+  run_directory = \
+    tempfile.mkdtemp(prefix='runs.',
+                     dir=os.path.dirname(os.path.abspath(
+                                                 sorted_simple_log_filepath)))
+  run_extension = compression.EXTENSIONS[run_codec]
+  run_filepaths = []
+  line_counter = 0
+  first_timestamp = None
+
+  def get_argss():
+    for run in read_runs(simple_log_filepaths, run_size):
+      run_filename = 'run.{}{}'.format(len(run_filepaths), run_extension)
+      run_filepath = os.path.join(run_directory, run_filename)
+      run_filepaths.append(run_filepath)
+      yield run, run_filepath, run_codec
+
+  if jobs > 1:
+    pool = multiprocessing.Pool(jobs)
+  else:
+    pool = None
+
+  try:
+    try:
+      for run_filepath, run_length, write_counter, run_first_timestamp in \
+          parallel.map_in_order(pool, write_run, get_argss(), window=jobs):
+        line_counter += run_length
+        if first_timestamp is None or run_first_timestamp < first_timestamp:
+          first_timestamp = run_first_timestamp
+        print('W {} ({:,} out of {:,} lines)'.format(run_filepath,
+                                                     write_counter,
+                                                     run_length))
+
+    finally:
+      if pool is not None:
+        pool.terminate()
+
+    if not (append and os.path.exists(sorted_simple_log_filepath)):
+      writer = open_writer(sorted_simple_log_filepath, codec, block_size,
+                           granularity)
+      write_counter = merge_runs(run_filepaths, writer)
+
+    elif can_append(sorted_simple_log_filepath, codec, first_timestamp):
+      # New days only: add blocks to the sorted log without touching the old.
+      writer = open_writer(sorted_simple_log_filepath, codec, block_size,
+                           granularity, append=True)
+      write_counter = merge_runs(run_filepaths, writer)
+
+    else:
+      # The new lines overlap the old, so merge everything into a new log.
+      merged_simple_log_filepath = sorted_simple_log_filepath + '.merged'
+      writer = open_writer(merged_simple_log_filepath, codec, block_size,
+                           granularity)
+      sorted_lines = partitioned_log.read_lines(sorted_simple_log_filepath,
+                                                jobs=jobs)
+      write_counter = merge_runs(run_filepaths, writer, sorted_lines)
+      replace(merged_simple_log_filepath, sorted_simple_log_filepath)
+
+  finally:
+    shutil.rmtree(run_directory)
+
+  print('W {} ({:,} out of {:,} lines)'.format(sorted_simple_log_filepath,
+                                               write_counter, line_counter))
+
+
+if __name__ == '__main__':
+  # rw for owner and group but not others
+  os.umask(0o07)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                      help='Number of processes that sort runs')
+  parser.add_argument('--memory-budget', type=int, default=MEMORY_BUDGET,
+                      metavar='MB',
+                      help='Memory for all runs being sorted at once')
+  parser.add_argument('--codec', default=compression.DEFAULT_CODEC,
+                      choices=compression.CODECS)
+  parser.add_argument('--block-size', type=int, default=block_log.BLOCK_SIZE)
+  parser.add_argument('--run-codec', default=RUN_CODEC,
+                      choices=compression.CODECS)
+  parser.add_argument('--append', action='store_true',
+                      help='Add the simple logs to the existing sorted log, '
+                           'rewriting it only if they overlap it in time')
+  parser.add_argument('--partition',
+                      choices=sorted(partitioned_log.GRANULARITIES),
+                      help='Split the sorted log into one file per UTC day or '
+                           'hour, in the directory OUTPUT')
+  parser.add_argument('--output', default=SORTED_SIMPLE_LOG_FILEPATH,
+                      help='Writes OUTPUT.EXT and OUTPUT.EXT.index')
+  parser.add_argument('simple_log_filepaths', nargs='*')
+  args = parser.parse_args()
+
+  simple_log_filepaths = args.simple_log_filepaths or \
+                         sorted(glob.glob(SIMPLE_LOGS))
+  assert simple_log_filepaths
+
+  os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+  if args.partition is None:
+    sorted_simple_log_filepath = \
+      args.output + compression.EXTENSIONS[args.codec]
+  else:
+    sorted_simple_log_filepath = args.output
+  sort(simple_log_filepaths, sorted_simple_log_filepath, args.memory_budget,
+       args.jobs, args.codec, args.block_size, args.run_codec, args.append,
+       args.partition)
+
+  # Like the shell script before it, clean up after the stripper.
+  if not args.simple_log_filepaths:
+    for simple_log_filepath in simple_log_filepaths:
+      os.remove(simple_log_filepath)
+      print('rm {}'.format(simple_log_filepath))
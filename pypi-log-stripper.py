@@ -2,20 +2,39 @@
 
 
 # 1st-party
-import calendar
+import argparse
+import collections
+import functools
 import glob
 import logging
-import lzma
+import multiprocessing
 import os
+import queue
 import re
-import sys
+import string
+import threading
 import time
 import traceback
 import urllib.parse
 
+# 2nd-party
+import anonymization
+import checkpoint
+import compression
+import http_date
+import manifest
+import parallel
+import spill_aggregator
+import string_ids
+
 
 SPACE_DELIMITER = ' '
 
+# Lines are decompressed into batches of this many lines, and at most this
+# many batches wait to be parsed.
+BATCH_SIZE = 10000
+QUEUE_SIZE = 16
+
 # Only OK. No partial content, no redirections, no buts.
 HTTP_STATUS_CODE_START = 200
 HTTP_STATUS_CODE_STOP = 200
@@ -31,10 +50,29 @@ LINE_REGEX = re.compile(r'^(<134>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z) '
                       '(\S+) (\S+): ([0-9a-f]{64}) "(.+)" "(-)" '
                       '"([A-Z]{3,9}) (.+) (HTTP/\d\.\d) (\d{3}) (.*) '
                       '(.*) (HIT|MISS) (\d+) "(.*)" "(.*)" "(.*)"$')
+# The fixed-width head of LINE_REGEX, up to the opening quote of the timestamp,
+# which the tokenizer matches before it finds the other fields by hand.
+LINE_HEAD_REGEX = re.compile(r'^(<134>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z) '
+                             r'(\S+) (\S+): ([0-9a-f]{64}) "')
+# After the head, the quotes of a line split it into this many fields.
+QUOTED_FIELDS = 11
+HTTP_VERSION_DELIMITER = ' HTTP/'
+CACHE_STATUSES = {'HIT', 'MISS'}
+# Counts lines tokenized by the fast path ('hit') and by LINE_REGEX ('miss'),
+# and, when checking, lines where the two disagree ('mismatch').
+TOKENIZER_COUNTER = collections.Counter()
+# Compare every fast path tokenization with LINE_REGEX. Set only in the main
+# process, which passes it on to parser processes with every batch.
+CHECK_TOKENIZER = False
 SHA256_PATTERN = re.compile('^[0-9a-f]{64}$')
 # URL pattern: http://stackoverflow.com/q/827557
 URL_REGEX = \
     re.compile(r'^(([^:/?#]+):)?(//([^/?#]*))?([^?#]*)(\?([^#]*))?(#(.*))?$')
+# Remember the normalizations of up to this many URLs.
+URL_CACHE_SIZE = 1024*1024
+# Characters that neither unquote nor quote would change.
+URL_SAFE_CHARACTERS = frozenset(string.ascii_letters + string.digits +
+                                '_.-~/')
 # However, we are interested in only valid /packages/ requests.
 URL_REGEX_FILTER = re.compile(r'^/packages/.+/.+/.+/.+\.\w+$')
 # These user-agents are chosen because they are most likely to use TUF:
@@ -43,22 +81,190 @@ URL_REGEX_FILTER = re.compile(r'^/packages/.+/.+/.+/.+\.\w+$')
 # here.
 USER_AGENT_FILTER = re.compile(r'^(pip|Python-urllib)/.+')
 
+# With --ingest, logs recorded here are not walked again.
+MANIFEST_FILEPATH = '/var/experiments-output/pypi-log-stripper.manifest.json'
+
+# To drop duplicates, the stripper remembers the requests of the seconds up to
+# this many seconds before the latest line so far.
+DEDUPLICATION_WINDOW = 60
+
+# Declarative filters, by name. A Stripper writes the lines that pass a filter
+# to NAME.DATE.log, and any number of Strippers may share one walk.
+FILTER_SPECS = {
+  # Package downloads by the user agents above.
+  'simple': {
+    'http_methods': HTTP_METHODS_FILTER,
+    'http_status_codes': (HTTP_STATUS_CODE_START, HTTP_STATUS_CODE_STOP),
+    'url_prefix': '/packages/',
+    'url_regex': URL_REGEX_FILTER,
+    'user_agent_prefixes': ('pip/', 'Python-urllib/'),
+    'user_agent_regex': USER_AGENT_FILTER,
+  },
+  # Simple index requests by the same user agents.
+  'index': {
+    'http_methods': HTTP_METHODS_FILTER,
+    'http_status_codes': (HTTP_STATUS_CODE_START, HTTP_STATUS_CODE_STOP),
+    'url_prefix': '/simple/',
+    'url_regex': re.compile(r'^/simple/[^/]+/$'),
+    'user_agent_prefixes': ('pip/', 'Python-urllib/'),
+    'user_agent_regex': USER_AGENT_FILTER,
+  },
+}
+
+
+class Filter:
+  '''
+  A filter spec, compiled into an exact test on parsed lines, and a cheap test
+  on raw lines that rejects most lines before they are ever parsed.
+  '''
+
+
+  def __init__(self, name, http_methods, http_status_codes, url_prefix,
+               url_regex, user_agent_prefixes, user_agent_regex):
+    self.name = name
+    self.http_methods = frozenset(http_methods)
+    self.http_status_code_start, self.http_status_code_stop = \
+      http_status_codes
+    self.url_regex = url_regex
+    self.user_agent_regex = user_agent_regex
+
+    # Any raw line that passes must contain, e.g., '"GET /packages/' as well as
+    # 'pip/'. Without a prefix, there is nothing to look for.
+    if url_prefix:
+      self.url_needles = tuple('"{} {}'.format(http_method,
+                                               url_prefix).encode('utf-8')
+                               for http_method in sorted(self.http_methods))
+    else:
+      self.url_needles = None
+
+    if user_agent_prefixes:
+      self.user_agent_needles = tuple(user_agent_prefix.encode('utf-8')
+                                      for user_agent_prefix
+                                      in user_agent_prefixes)
+    else:
+      self.user_agent_needles = None
+
+
+  def match(self, http_method, url, http_status_code, user_agent):
+    return http_method in self.http_methods and \
+           http_status_code >= self.http_status_code_start and \
+           http_status_code <= self.http_status_code_stop and \
+           self.url_regex.match(url) and \
+           self.user_agent_regex.match(user_agent)
+
+
+  # Must never reject a raw line whose parsed line would match. URLs are
+  # unquoted before they are matched, so a quoted URL cannot be ruled out.
+  def prefilter(self, line):
+    if self.url_needles is not None and \
+       not any(needle in line for needle in self.url_needles) and \
+       b'%' not in line:
+      return False
+
+    if self.user_agent_needles is not None and \
+       not any(needle in line for needle in self.user_agent_needles):
+      return False
+
+    return True
+
+
+def get_filter(name):
+  return Filter(name, **FILTER_SPECS[name])
+
+
+class Deduplicator:
+  '''
+  Remembers every (IP address, URL, user agent) requested in each second, but
+  only for the seconds within a window of the latest second seen so far.
+  Lines are logged in roughly, but not exactly, the order of time, so a
+  duplicate that comes later than the window will not be noticed.
+  '''
+
+
+  def __init__(self, window=DEDUPLICATION_WINDOW):
+    assert window >= 0
+    self.window = window
+
+    # unix_timestamp: set((ip_address, url, user_agent))
+    self.requests_by_second = {}
+    self.latest_timestamp = None
+    self.duplicate_counter = 0
+    self.late_counter = 0
+
+
+  def is_duplicate(self, ip_address, unix_timestamp, url, user_agent):
+    if self.latest_timestamp is None or unix_timestamp > self.latest_timestamp:
+      self.latest_timestamp = unix_timestamp
+      self.evict()
+
+    requests = self.requests_by_second.get(unix_timestamp)
+    if requests is None:
+      if unix_timestamp < self.latest_timestamp-self.window:
+        # Too late to tell, so leave it to the sorter.
+        self.late_counter += 1
+        return False
+
+      requests = set()
+      self.requests_by_second[unix_timestamp] = requests
+
+    request = (ip_address, url, user_agent)
+    if request in requests:
+      self.duplicate_counter += 1
+      return True
+
+    requests.add(request)
+    return False
+
+
+  def get_state(self):
+    return {
+      'latest_timestamp': self.latest_timestamp,
+      'requests_by_second': [[unix_timestamp, list(requests)]
+                             for unix_timestamp, requests
+                             in self.requests_by_second.items()],
+      'duplicate_counter': self.duplicate_counter,
+      'late_counter': self.late_counter,
+    }
+
+
+  def set_state(self, state):
+    self.latest_timestamp = state['latest_timestamp']
+    self.requests_by_second = {unix_timestamp: set(map(tuple, requests))
+                               for unix_timestamp, requests
+                               in state['requests_by_second']}
+    self.duplicate_counter = state['duplicate_counter']
+    self.late_counter = state['late_counter']
+
+
+  def evict(self):
+    oldest_timestamp = self.latest_timestamp-self.window
+    for unix_timestamp in [unix_timestamp for unix_timestamp
+                           in self.requests_by_second
+                           if unix_timestamp < oldest_timestamp]:
+      del self.requests_by_second[unix_timestamp]
+
 
 class Stripper:
 
 
+  def __init__(self, line_filter=None,
+               deduplication_window=DEDUPLICATION_WINDOW):
+    if line_filter is None:
+      line_filter = get_filter('simple')
+    self.line_filter = line_filter
+    self.deduplication_window = deduplication_window
+
+
   def pre_walk(self, anonymized_compressed_filepath):
     self.write_counter = 0
-
-    # Set only for filtered lines.
-    self.prev_ip_address = None
-    self.prev_unix_timestamp = None
-    self.prev_url = None
-    self.prev_user_agent = None
+    # Only for filtered lines.
+    self.deduplicator = Deduplicator(self.deduplication_window)
 
     anonymized_compressed_dirname = \
       os.path.dirname(anonymized_compressed_filepath)
-    simple_uncompressed_filename = 'simple.{}.log'.format(date)
+    date = get_date(anonymized_compressed_filepath)
+    simple_uncompressed_filename = '{}.{}.log'.format(self.line_filter.name,
+                                                      date)
     simple_uncompressed_filepath = \
       os.path.join(anonymized_compressed_dirname, simple_uncompressed_filename)
 
@@ -69,19 +275,11 @@ class Stripper:
   # Write only filtered lines.
   def in_walk(self, ip_address, unix_timestamp, http_method, url,
               http_status_code, user_agent):
-    if http_method in HTTP_METHODS_FILTER and \
-       http_status_code >= HTTP_STATUS_CODE_START and \
-       http_status_code <= HTTP_STATUS_CODE_STOP and \
-       URL_REGEX_FILTER.match(url) and \
-       USER_AGENT_FILTER.match(user_agent):
-      # Write only filtered lines that are not consecutive duplicates.
-      # That is, consider filtered lines L1 and L2 that are duplicates.
-      # L2 will not be written only if it consecutively follows L1.
-      if ip_address != self.prev_ip_address or \
-         unix_timestamp != self.prev_unix_timestamp or \
-         url != self.prev_url or \
-         user_agent != self.prev_user_agent:
-        # Write the new line.
+    if self.line_filter.match(http_method, url, http_status_code, user_agent):
+      # Write only filtered lines that are not duplicates, as far as we can
+      # tell. The sorter removes the rest.
+      if not self.deduplicator.is_duplicate(ip_address, unix_timestamp, url,
+                                            user_agent):
         stripped_line = '"{}","{}","{}","{}"\n'.format(unix_timestamp,
                                                        ip_address, url,
                                                        user_agent)
@@ -89,32 +287,73 @@ class Stripper:
         self.simple_uncompressed_file.write(stripped_line)
         self.write_counter += 1
 
-        # Replace previously observed values.
-        self.prev_ip_address = ip_address
-        self.prev_unix_timestamp = unix_timestamp
-        self.prev_url = url
-        self.prev_user_agent = user_agent
-
 
   def post_walk(self, parse_error_counter, line_counter):
     write_rate = (self.write_counter / line_counter) * 100
     logging.info('Wrote {} out of {} ({}%) lines'.format(self.write_counter,
                                                          line_counter,
                                                          write_rate))
+    logging.info('Dropped {} duplicates, and let {} lines through that came '
+                 'too late to tell'.format(self.deduplicator.duplicate_counter,
+                                           self.deduplicator.late_counter))
 
     self.simple_uncompressed_file.close()
     logging.info('W ' + self.simple_uncompressed_filepath)
 
 
+  def get_state(self):
+    self.simple_uncompressed_file.flush()
+
+    return {
+      'simple_uncompressed_filepath': self.simple_uncompressed_filepath,
+      'position': self.simple_uncompressed_file.tell(),
+      'write_counter': self.write_counter,
+      'deduplicator': self.deduplicator.get_state(),
+    }
+
+
+  # Instead of pre_walk, to resume from a checkpoint. Lines written after the
+  # checkpoint will be written again, so throw them away.
+  def set_state(self, state):
+    self.write_counter = state['write_counter']
+    self.deduplicator = Deduplicator(self.deduplication_window)
+    self.deduplicator.set_state(state['deduplicator'])
+
+    self.simple_uncompressed_filepath = state['simple_uncompressed_filepath']
+    self.simple_uncompressed_file = \
+      checkpoint.reopen(self.simple_uncompressed_filepath, state['position'])
+
+
 class Surveyor:
 
 
-  def __init__(self):
-    # IP address => a set of user agents
-    self.ip_address_to_user_agents = {}
+  # IP addresses and user agents are kept as their ids in the shared
+  # dictionaries of string_ids.
+  def __init__(self, dictionary_directory=string_ids.DIRECTORY):
+    self.dictionary_directory = dictionary_directory
+    self.ip_addresses = None
+    self.user_agents = None
+    # IP address id => a set of user agent ids, spilled to disk when there
+    # are too many to keep in memory.
+    self.ip_address_to_user_agents = spill_aggregator.SetAggregator()
+
+
+  # Only when surveying, since the dictionaries may be large.
+  def load_dictionaries(self):
+    if self.ip_addresses is None:
+      self.ip_addresses = string_ids.load('ip_addresses',
+                                          self.dictionary_directory)
+      self.user_agents = string_ids.load('user_agents',
+                                         self.dictionary_directory)
+
+
+  def save_dictionaries(self):
+    self.ip_addresses.save()
+    self.user_agents.save()
 
 
   def pre_walk(self, anonymized_compressed_filepath):
+    self.load_dictionaries()
     # Will be overwritten when walking the next log.
     self.anonymized_compressed_filepath = anonymized_compressed_filepath
 
@@ -122,87 +361,451 @@ class Surveyor:
   # Write only filtered lines.
   def in_walk(self, ip_address, unix_timestamp, http_method, url,
               http_status_code, user_agent):
-    self.ip_address_to_user_agents.setdefault(ip_address,
-                                              set()).add(user_agent)
+    self.ip_address_to_user_agents.add(self.ip_addresses.get_id(ip_address),
+                                       self.user_agents.get_id(user_agent))
 
 
   def post_walk(self, parse_error_counter, line_counter):
-    number_of_users = sum(
-      len(user_agents)  \
-      for user_agents   \
-      in self.ip_address_to_user_agents.values()
-    )
+    self.save_dictionaries()
+
+    number_of_ip_addresses = 0
+    number_of_users = 0
+    for ip_address_id, user_agent_ids in \
+        self.ip_address_to_user_agents.items():
+      number_of_ip_addresses += 1
+      number_of_users += len(user_agent_ids)
 
     logging.info('R {}'.format(self.anonymized_compressed_filepath))
     logging.info('There were {:,} IP addresses.'\
-                 .format(len(self.ip_address_to_user_agents)))
+                 .format(number_of_ip_addresses))
     logging.info('There were {:,} users identified by '\
                  '(IP address, user agent).'.format(number_of_users))
     logging.info('There were {:,} HTTP requests.'.format(line_counter))
 
 
-def walk(anonymized_compressed_filepath, pre_walk, in_walk, post_walk):
-  anonymized_compressed_filename = \
-    os.path.basename(anonymized_compressed_filepath)
-  prefix, date, ext = anonymized_compressed_filename.split('.')
-  assert prefix == 'anonymized'
-  assert ext == 'xz'
+  # The ids in the state are good only if the dictionaries are saved first.
+  def get_state(self):
+    self.save_dictionaries()
 
-  line_counter = 0
-  parse_error_counter = 0
+    return {
+      'anonymized_compressed_filepath':
+        getattr(self, 'anonymized_compressed_filepath', None),
+      # The runs on disk of IP address id => [user agent id, ...]
+      'ip_address_to_user_agents':
+        self.ip_address_to_user_agents.get_state(),
+    }
 
-  pre_walk(anonymized_compressed_filepath)
 
-  # For some reason, reading the file line by line as 'b' instead of 't' is
-  # more robust.
-  with lzma.open(anonymized_compressed_filepath, 'rb') as \
-                                                    anonymized_compressed_file:
+  def set_state(self, state):
+    self.load_dictionaries()
+    self.anonymized_compressed_filepath = \
+      state['anonymized_compressed_filepath']
+    self.ip_address_to_user_agents.set_state(
+      state['ip_address_to_user_agents'])
 
-    for line in anonymized_compressed_file:
-      line_counter += 1
-
-      try:
-        # TODO: salvage as much as possible from the line
-        normalized_line = line.decode('utf-8')
-        tokens = LINE_REGEX.match(normalized_line).groups()
-
-        ip_address = tokens[3]
-        assert SHA256_PATTERN.match(ip_address), ip_address
-
-        timestamp_string = tokens[4]
-        # http://stackoverflow.com/a/466366
-        gm_timestamp = time.strptime(timestamp_string,
-                                     '%a, %d %b %Y %H:%M:%S %Z')
-        unix_timestamp = calendar.timegm(gm_timestamp)
-
-        http_method = tokens[6]
-        assert http_method in HTTP_METHODS, http_method
-        # Why replace quotes with nothing?
-        # Because sometimes URLs with spaces are not properly quoted.
-        # e.g. '"GET /packages/source/Z/Zachs-data-dump/Zachs" data dump-1.0.1.tar.gz'
-        # Why unquote and then quote the URL?
-        # Because we do not want to quote already quoted characters.
-        url = \
-          urllib.parse.quote(urllib.parse.unquote(tokens[7].replace('"', '')))
-        assert URL_REGEX.match(url), url
-        http_status_code = int(tokens[9])
-
-        user_agent = tokens[16].strip()
-
-      except:
-        parse_error_counter += 1
-        logging.info('WARNING: line {} was skipped!'.format(line_counter))
-        logging.info(line)
-        logging.info(traceback.format_exc())
 
-      else:
-        in_walk(ip_address, unix_timestamp, http_method, url, http_status_code,
-                user_agent)
+  # Remove what was spilled to disk, once all logs are surveyed.
+  def close(self):
+    self.ip_address_to_user_agents.close()
+
+
+def get_date(log_filepath):
+  log_filename = os.path.basename(log_filepath)
+
+  # Either an anonymized log, or the raw log (e.g. DATE.gz) it came from.
+  if log_filename.startswith('anonymized.'):
+    prefix, date, *ext = log_filename.split('.')
+    assert prefix == 'anonymized'
+    assert len(ext) <= 1
+
+  else:
+    date = log_filename.split('.')[0]
+
+  return date
+
+
+# Returns the same groups as LINE_REGEX, but finds the fields by their
+# delimiters instead of backtracking through them. Returns None whenever the
+# line is not plainly in the usual format, in which case only LINE_REGEX can
+# say how it would match, if at all.
+def tokenize_line(normalized_line):
+  # Like $, allow one trailing newline, but no other.
+  if normalized_line.endswith('\n'):
+    normalized_line = normalized_line[:-1]
+  if '\n' in normalized_line:
+    return None
+
+  head_match = LINE_HEAD_REGEX.match(normalized_line)
+  if head_match is None:
+    return None
+
+  # When no field holds a quote, every quote is a delimiter:
+  # TIMESTAMP" "-" "REQUEST" "REFERER" "..." "USER_AGENT"
+  fields = normalized_line[head_match.end():].split('"')
+  if len(fields) != QUOTED_FIELDS or not fields[0] or fields[2] != '-' or \
+     fields[10] or \
+     any(fields[i] != ' ' for i in (1, 3, 6, 8)):
+    return None
+  timestamp_string = fields[0]
+
+  # ([A-Z]{3,9}) (.+) (HTTP/\d\.\d) (\d{3}) (.*) (.*) (HIT|MISS) (\d+)
+  request = fields[4]
+  if not request.endswith(' '):
+    return None
+  request = request[:-1].rsplit(' ', 2)
+  if len(request) != 3:
+    return None
+  request, cache_status, size = request
+  if cache_status not in CACHE_STATUSES or not size.isdecimal():
+    return None
+
+  http_method_stop = request.find(' ')
+  http_method = request[:http_method_stop]
+  if http_method_stop < 0 or not 3 <= len(http_method) <= 9 or \
+     not http_method.isascii() or not http_method.isalpha() or \
+     not http_method.isupper():
+    return None
+
+  # The URL may hold spaces, so there must be just one place where it can end.
+  url_stop = request.find(HTTP_VERSION_DELIMITER, http_method_stop)
+  if url_stop <= http_method_stop+1 or \
+     request.find(HTTP_VERSION_DELIMITER, url_stop+1) >= 0:
+    return None
+  url = request[http_method_stop+1:url_stop]
+
+  # HTTP/d.d ddd (.*) (.*)
+  response = request[url_stop+1:]
+  http_version = response[:8]
+  http_status_code = response[9:12]
+  if len(response) < 14 or not response[5].isdecimal() or \
+     response[6] != '.' or not response[7].isdecimal() or \
+     response[8] != ' ' or not http_status_code.isdecimal() or \
+     response[12] != ' ':
+    return None
+  response_fields = response[13:]
+  response_field_delimiter = response_fields.rfind(' ')
+  if response_field_delimiter < 0:
+    return None
+
+  return head_match.groups() + \
+         (timestamp_string, '-', http_method, url, http_version,
+          http_status_code, response_fields[:response_field_delimiter],
+          response_fields[response_field_delimiter+1:], cache_status, size,
+          fields[5], fields[7], fields[9])
+
+
+# Most requests are for relatively few URLs, so remember whether each of them
+# is valid along with its normalization.
+@functools.lru_cache(maxsize=URL_CACHE_SIZE)
+def normalize_url(url):
+  # Nothing to unquote or quote.
+  if URL_SAFE_CHARACTERS.issuperset(url):
+    normalized_url = url
+
+  # Why replace quotes with nothing?
+  # Because sometimes URLs with spaces are not properly quoted.
+  # e.g. '"GET /packages/source/Z/Zachs-data-dump/Zachs" data dump-1.0.1.tar.gz'
+  # Why unquote and then quote the URL?
+  # Because we do not want to quote already quoted characters.
+  else:
+    unquoted_url = urllib.parse.unquote(url.replace('"', ''))
+    normalized_url = urllib.parse.quote(unquoted_url)
+
+  return normalized_url, URL_REGEX.match(normalized_url) is not None
+
+
+def parse_line(line, check_tokenizer=False):
+  # TODO: salvage as much as possible from the line
+  normalized_line = line.decode('utf-8')
+  tokens = tokenize_line(normalized_line)
+
+  if tokens is None:
+    TOKENIZER_COUNTER['miss'] += 1
+    tokens = LINE_REGEX.match(normalized_line).groups()
+
+  else:
+    TOKENIZER_COUNTER['hit'] += 1
+    if check_tokenizer:
+      regex_match = LINE_REGEX.match(normalized_line)
+      if regex_match is None or regex_match.groups() != tokens:
+        TOKENIZER_COUNTER['mismatch'] += 1
+        logging.info('Tokenizer mismatch: {!r}'.format(normalized_line))
+
+  ip_address = tokens[3]
+  assert SHA256_PATTERN.match(ip_address), ip_address
+
+  timestamp_string = tokens[4]
+  unix_timestamp = http_date.decode(timestamp_string)
+
+  http_method = tokens[6]
+  assert http_method in HTTP_METHODS, http_method
+  url, is_valid_url = normalize_url(tokens[7])
+  assert is_valid_url, url
+  http_status_code = int(tokens[9])
+
+  user_agent = tokens[16].strip()
+
+  return ip_address, unix_timestamp, http_method, url, http_status_code, \
+         user_agent
+
+
+# Runs in a parser process. Measures CPU time, since parser processes may well
+# share cores. Given filters, lines that none of them would pass are not parsed.
+def parse_batch(batch, line_filters=None, check_tokenizer=False):
+  start_time = time.thread_time()
+  TOKENIZER_COUNTER.clear()
+  # [(parsed line, None) or (None, (line, traceback)) or (None, None), ...]
+  parsed_batch = []
+
+  for line in batch:
+    if line_filters is not None and \
+       not any(line_filter.prefilter(line) for line_filter in line_filters):
+      parsed_batch.append((None, None))
+      continue
+
+    try:
+      parsed_batch.append((parse_line(line, check_tokenizer), None))
+    except:
+      parsed_batch.append((None, (line, traceback.format_exc())))
+
+  return parsed_batch, time.thread_time()-start_time, TOKENIZER_COUNTER.copy()
+
+
+# Runs in the producer thread, which decompresses the log into batches of lines
+# while the parser processes are busy with earlier batches.
+def read_batches(lines, batch_queue, stage_seconds):
+  start_time = time.perf_counter()
+
+  try:
+    batch = []
+
+    for line in lines:
+      batch.append(line)
+
+      if len(batch) == BATCH_SIZE:
+        stage_seconds['read'] += time.perf_counter()-start_time
+        batch_queue.put(batch)
+        start_time = time.perf_counter()
+        batch = []
+
+    stage_seconds['read'] += time.perf_counter()-start_time
+    if batch:
+      batch_queue.put(batch)
+
+  except BaseException as e:
+    batch_queue.put(e)
+
+  finally:
+    batch_queue.put(None)
+
+
+def log_throughput(stage_seconds, line_counter):
+  for stage in ('read', 'parse', 'visit'):
+    seconds = stage_seconds[stage]
+    if seconds > 0:
+      logging.info('{}: {:,.0f} lines/s ({:.2f}s)'.format(stage,
+                                                          line_counter/seconds,
+                                                          seconds))
+
+
+# Given the state of a walk, resumes counting from it. Given a checkpoint, saves
+# the state of the walk, including its visitors, every so often.
+def walk_lines(lines, visitors, jobs=1, walk_state=None, progress=None):
+  if walk_state is None:
+    walk_state = {'offset': 0, 'line_counter': 0, 'parse_error_counter': 0}
+  in_walks = [visitor.in_walk for visitor in visitors]
+  # Uncompressed bytes of the lines walked so far.
+  offset = walk_state['offset']
+  first_line_counter = walk_state['line_counter']
+  line_counter = walk_state['line_counter']
+  parse_error_counter = walk_state['parse_error_counter']
+  prefilter_counter = 0
+  tokenizer_counter = collections.Counter()
+
+  # Lines may be rejected before they are parsed, but only if every visitor
+  # has a filter that says which lines it wants.
+  line_filters = [getattr(visitor, 'line_filter', None)
+                  for visitor in visitors]
+  if any(line_filter is None for line_filter in line_filters):
+    line_filters = None
+
+  # Time spent reading (decompressing) lines, parsing lines (CPU time, summed
+  # over all parser processes), and visiting parsed lines.
+  stage_seconds = collections.Counter()
+  batch_queue = queue.Queue(maxsize=QUEUE_SIZE)
+  producer = threading.Thread(target=read_batches,
+                              args=(lines, batch_queue, stage_seconds),
+                              daemon=True)
+  # Uncompressed bytes of each batch being parsed, in order.
+  batch_sizes = collections.deque()
+
+  def get_batches():
+    while True:
+      batch = batch_queue.get()
+      if batch is None:
+        break
+      if isinstance(batch, BaseException):
+        raise batch
+      batch_sizes.append(sum(len(line) for line in batch))
+      yield (batch, line_filters, CHECK_TOKENIZER)
+
+  # Fork the parser processes before starting the producer thread, so that
+  # they never inherit a lock that the thread holds.
+  if jobs > 1:
+    pool = multiprocessing.Pool(jobs)
+  else:
+    pool = None
+
+  try:
+    producer.start()
+
+    for parsed_batch, parse_seconds, batch_tokenizer_counter in \
+        parallel.map_in_order(pool, parse_batch, get_batches(), window=jobs*2):
+      stage_seconds['parse'] += parse_seconds
+      tokenizer_counter.update(batch_tokenizer_counter)
+      start_time = time.perf_counter()
+
+      # Visit in the original order of the lines.
+      for parsed_line, parse_error in parsed_batch:
+        line_counter += 1
+
+        if parsed_line is not None:
+          for in_walk in in_walks:
+            in_walk(*parsed_line)
+
+        elif parse_error is None:
+          prefilter_counter += 1
+
+        else:
+          line, parse_traceback = parse_error
+          parse_error_counter += 1
+          logging.info('WARNING: line {} was skipped!'.format(line_counter))
+          logging.info(line)
+          logging.info(parse_traceback)
+
+      stage_seconds['visit'] += time.perf_counter()-start_time
+      offset += batch_sizes.popleft()
+
+      if progress is not None and progress.is_due():
+        walk_state.update(offset=offset, line_counter=line_counter,
+                          parse_error_counter=parse_error_counter,
+                          visitors=[visitor.get_state()
+                                    for visitor in visitors])
+        progress.save(walk=walk_state)
+
+  finally:
+    if pool is not None:
+      pool.terminate()
+
+  producer.join()
 
   parse_error_rate = (parse_error_counter / line_counter) * 100
   logging.info('Parsing error rate: {}%'.format(parse_error_rate))
+  logging.info('Tokenizer fast path: {} hits, {} misses, {} mismatches'.\
+               format(tokenizer_counter['hit'], tokenizer_counter['miss'],
+                      tokenizer_counter['mismatch']))
+  if line_filters is not None:
+    prefilter_rate = (prefilter_counter / line_counter) * 100
+    logging.info('Rejected {} ({}%) lines before parsing'.\
+                 format(prefilter_counter, prefilter_rate))
+  log_throughput(stage_seconds, line_counter-first_line_counter)
+
+  return parse_error_counter, line_counter
+
+
+# Every visitor has pre_walk, in_walk and post_walk methods. Each line is
+# decompressed and parsed only once, no matter how many visitors see it.
+# Given a checkpoint, visitors must also have get_state and set_state methods,
+# and a walk of the same file is resumed from the checkpoint.
+def walk(anonymized_compressed_filepath, visitors, jobs=1, progress=None):
+  # Also checks the filename.
+  get_date(anonymized_compressed_filepath)
+
+  if progress is not None:
+    walk_state = progress.get('walk')
+  else:
+    walk_state = None
+
+  if walk_state is not None and \
+     walk_state['filepath'] == anonymized_compressed_filepath:
+    assert len(walk_state['visitors']) == len(visitors)
+    for visitor, visitor_state in zip(visitors, walk_state['visitors']):
+      visitor.set_state(visitor_state)
+    logging.info('Resuming {} from line {}'.\
+                 format(anonymized_compressed_filepath,
+                        walk_state['line_counter']))
+
+  else:
+    walk_state = {'filepath': anonymized_compressed_filepath, 'offset': 0,
+                  'line_counter': 0, 'parse_error_counter': 0}
+    for visitor in visitors:
+      visitor.pre_walk(anonymized_compressed_filepath)
 
-  post_walk(parse_error_counter, line_counter)
+  # For some reason, reading the file line by line as 'b' instead of 't' is
+  # more robust.
+  with compression.open(anonymized_compressed_filepath, 'rb') as \
+                                                    anonymized_compressed_file:
+    checkpoint.skip(anonymized_compressed_file, walk_state['offset'])
+    parse_error_counter, line_counter = \
+      walk_lines(anonymized_compressed_file, visitors, jobs, walk_state,
+                 progress)
+
+  for visitor in visitors:
+    visitor.post_walk(parse_error_counter, line_counter)
+
+
+# Anonymize and walk a raw log in one pass, instead of first writing, and then
+# decompressing, an anonymized log that is mostly filtered out anyway.
+def walk_raw(raw_filepath, ip_field_index, visitors, write_anonymized=False,
+             codec=compression.DEFAULT_CODEC, jobs=1):
+  if write_anonymized:
+    anonymized_compressed_filename = \
+      'anonymized.{}{}'.format(get_date(raw_filepath),
+                               compression.EXTENSIONS[codec])
+    anonymized_compressed_filepath = \
+      os.path.join(os.path.dirname(raw_filepath),
+                   anonymized_compressed_filename)
+    anonymized_compressed_file = \
+      compression.open(anonymized_compressed_filepath, 'wb', codec)
+  else:
+    anonymized_compressed_file = None
+
+  def read_anonymized_lines(raw_file):
+    anonymized_block = bytearray()
+
+    for raw_block in anonymization.read_blocks(raw_file):
+      anonymization.anonymize_block(raw_block, ip_field_index,
+                                    anonymized_block)
+      if anonymized_compressed_file is not None:
+        anonymized_compressed_file.write(anonymized_block)
+
+      # Only at newlines, as iterating over a file would: splitlines would also
+      # split at the \r that some user agents hold. The block is reused, so
+      # copy out only the lines.
+      anonymized_view = memoryview(anonymized_block)
+      start = 0
+      while start < len(anonymized_block):
+        end = anonymized_block.find(b'\n', start)+1 or len(anonymized_block)
+        yield bytes(anonymized_view[start:end])
+        start = end
+      anonymized_view.release()
+      del anonymized_block[:]
+
+  for visitor in visitors:
+    visitor.pre_walk(raw_filepath)
+
+  try:
+    with compression.open(raw_filepath, 'rb') as raw_file:
+      parse_error_counter, line_counter = \
+        walk_lines(read_anonymized_lines(raw_file), visitors, jobs)
+
+  finally:
+    if anonymized_compressed_file is not None:
+      anonymized_compressed_file.close()
+      logging.info('W ' + anonymized_compressed_filepath)
+
+  for visitor in visitors:
+    visitor.post_walk(parse_error_counter, line_counter)
 
 
 if __name__ == '__main__':
@@ -215,21 +818,121 @@ if __name__ == '__main__':
                              '[%(funcName)s:%(lineno)s@%(filename)s] '\
                              '%(message)s')
 
-  if len(sys.argv) >= 2:
-    pypi_log_files = sys.argv[1:]
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-j', '--jobs', type=int, default=1,
+                      help='Number of parser processes')
+  parser.add_argument('--raw', type=int, metavar='IP_FIELD_INDEX',
+                      help='Anonymize and strip raw (plain or gzipped) logs '
+                           'in one pass')
+  parser.add_argument('--write-anonymized', action='store_true',
+                      help='With --raw, also write the anonymized logs')
+  parser.add_argument('--codec', default=compression.DEFAULT_CODEC,
+                      choices=compression.CODECS,
+                      help='With --write-anonymized, compress them thus')
+  parser.add_argument('--hash', default='sha256',
+                      choices=anonymization.HASH_ALGORITHMS,
+                      help='With --raw, use blake2b only for new datasets')
+  parser.add_argument('--filter', action='append', dest='filters',
+                      choices=sorted(FILTER_SPECS),
+                      help='Write the lines that pass this filter (default: '
+                           'simple); may be given more than once')
+  parser.add_argument('--no-survey', action='store_true',
+                      help='Do not survey users, so that lines that pass no '
+                           'filter need not be parsed')
+  parser.add_argument('--deduplication-window', type=int,
+                      default=DEDUPLICATION_WINDOW, metavar='SECONDS',
+                      help='Drop duplicates that come at most this late')
+  parser.add_argument('--checkpoint', metavar='CHECKPOINT_FILE',
+                      help='Save progress to this file, and resume from it '
+                           'if it exists (not with --raw)')
+  parser.add_argument('--checkpoint-interval', type=int,
+                      default=checkpoint.INTERVAL, metavar='SECONDS')
+  parser.add_argument('--ingest', action='store_true',
+                      help='Walk only the logs that are not in the manifest, '
+                           'and then add them to it')
+  parser.add_argument('--manifest', default=MANIFEST_FILEPATH,
+                      help='With --ingest, the manifest of walked logs')
+  parser.add_argument('--check-tokenizer', action='store_true',
+                      help='Check every line that the tokenizer parses '
+                           'against LINE_REGEX')
+  parser.add_argument('pypi_log_files', nargs='*')
+  args = parser.parse_args()
+
+  if args.raw is not None:
+    assert args.raw >= 0
+    assert args.pypi_log_files
+    anonymization.init_hash(anonymization.SALT, args.hash)
+    pypi_log_files = args.pypi_log_files
+
+  elif args.pypi_log_files:
+    pypi_log_files = args.pypi_log_files
 
   else:
     pypi_log_files = \
-      glob.glob('/var/experiments-output/anonymized/anonymized.*.xz')
+      sorted(glob.glob('/var/experiments-output/anonymized/anonymized.*'))
+
+  if args.ingest:
+    processed_logs = manifest.Manifest(args.manifest)
+    pypi_log_files = [pypi_log_file for pypi_log_file in pypi_log_files
+                      if pypi_log_file not in processed_logs]
+    # Remember the mtimes of logs that were touched but not changed.
+    processed_logs.save()
+    logging.info('Ingesting {} new logs'.format(len(pypi_log_files)))
+  else:
+    processed_logs = None
+
+  CHECK_TOKENIZER = args.check_tokenizer
+  filters = [get_filter(name) for name in args.filters or ['simple']]
 
   # A surveyor for all raw logs.
   surveyor = Surveyor()
 
-  for anonymized_compressed_filepath in pypi_log_files:
-    walk(anonymized_compressed_filepath, surveyor.pre_walk, surveyor.in_walk,
-         surveyor.post_walk)
+  if args.checkpoint is not None:
+    # Raw logs cannot be resumed, since the salt is never stored anywhere.
+    assert args.raw is None
+    progress = checkpoint.Checkpoint(args.checkpoint,
+                                     args.checkpoint_interval)
+
+    if progress:
+      assert progress.get('pypi_log_files') == pypi_log_files
+      if progress.get('surveyor') is not None:
+        surveyor.set_state(progress.get('surveyor'))
+    else:
+      progress.save(pypi_log_files=pypi_log_files, walked=[])
+
+  else:
+    progress = None
+
+  for pypi_log_file in pypi_log_files:
+    if progress is not None and pypi_log_file in progress.get('walked'):
+      logging.info('Already walked {}'.format(pypi_log_file))
+      continue
+
+    # A stripper for every filter for every raw log.
+    visitors = [Stripper(line_filter, args.deduplication_window)
+                for line_filter in filters]
+    if not args.no_survey:
+      visitors.insert(0, surveyor)
+
+    if args.raw is not None:
+      walk_raw(pypi_log_file, args.raw, visitors,
+               write_anonymized=args.write_anonymized, codec=args.codec,
+               jobs=args.jobs)
+    else:
+      walk(pypi_log_file, visitors, args.jobs, progress)
+
+    if progress is not None:
+      if args.no_survey:
+        surveyor_state = None
+      else:
+        surveyor_state = surveyor.get_state()
+      progress.save(walked=progress.get('walked')+[pypi_log_file], walk=None,
+                    surveyor=surveyor_state)
+
+    if processed_logs is not None:
+      processed_logs.add(pypi_log_file)
+      processed_logs.save()
 
-    # A stripper for every raw log.
-    stripper = Stripper()
-    walk(anonymized_compressed_filepath, stripper.pre_walk, stripper.in_walk,
-         stripper.post_walk)
+  if progress is not None:
+    progress.remove()
+  surveyor.close()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+'''
+A sparse cube of request counts by (project, UTC hour), materialized next to
+the sorted simple log, so that counting the requests for a project, or ranking
+all projects, over any window of whole hours is a lookup instead of a scan:
+
+  SORTED_SIMPLE_LOG.cube/offsets.npy            int64, one per project id + 1
+  SORTED_SIMPLE_LOG.cube/hours.npy              int32, one per nonempty cell
+  SORTED_SIMPLE_LOG.cube/cumulative_counts.npy  int64, one per cell + 1
+
+Cells are sorted by project id, and then by hour: the cells of project p are
+offsets[p]:offsets[p+1]. cumulative_counts[i] is the number of requests in
+the cells before cell i, so the requests of a project between two hours are
+the difference of two cumulative counts, found by binary search.
+
+Project ids are those of the shared dictionaries of string_ids.
+
+USAGE: python3 request_cube.py [-j JOBS] [--since T0] [--until T1] [--top N]
+                               [SORTED_SIMPLE_LOG]
+Builds the cube of SORTED_SIMPLE_LOG (a block log, a directory of partitions,
+or an event store), if it is not up to date, and prints the top N projects by
+requests where T0 <= timestamp < T1.
+'''
+
+
+# 1st-party
+import argparse
+import collections
+import json
+import os
+
+# 3rd-party
+import numpy
+
+# 2nd-party
+import event_store
+import partitioned_log
+import simple_log
+import string_ids
+
+
+SORTED_SIMPLE_LOG_FILEPATH = \
+  '/var/experiments-output/simple/sorted.simple.log.xz'
+CUBE_EXTENSION = '.cube'
+
+# Every cell counts the requests of one project in this many seconds.
+SECONDS = 60*60
+
+COLUMNS = ('offsets', 'hours', 'cumulative_counts')
+# The log, and its mtime, as of the last build.
+SOURCE_FILENAME = 'source.json'
+
+
+def get_cube_directory(filepath):
+  return filepath.rstrip(os.sep) + CUBE_EXTENSION
+
+
+def get_column_filepath(directory, column):
+  return os.path.join(directory, column + '.npy')
+
+
+# The file that changes whenever the log does.
+def get_source_filepath(filepath):
+  if event_store.is_event_store(filepath):
+    return event_store.get_column_filepath(filepath, 'timestamps')
+  elif os.path.isdir(filepath):
+    return partitioned_log.get_catalog_filepath(filepath)
+  else:
+    return filepath
+
+
+def get_source(filepath):
+  source_filepath = get_source_filepath(filepath)
+  return {'filepath': os.path.abspath(source_filepath),
+          'mtime': os.path.getmtime(source_filepath)}
+
+
+def is_up_to_date(filepath):
+  source_filepath = os.path.join(get_cube_directory(filepath),
+                                 SOURCE_FILENAME)
+  if not os.path.exists(source_filepath):
+    return False
+
+  with open(source_filepath, 'rt') as source_file:
+    return json.load(source_file) == get_source(filepath)
+
+
+# The cube can answer only for windows of whole hours.
+def can_count(since=None, until=None):
+  return (since is None or since % SECONDS == 0) and \
+         (until is None or until % SECONDS == 0)
+
+
+# The project ids, hours and request counts of all nonempty cells, sorted by
+# project id, and then by hour.
+def count_cells(filepath, jobs=1, dictionary_directory=string_ids.DIRECTORY):
+  if event_store.is_event_store(filepath):
+    store = event_store.EventStore(filepath,
+                                   dictionary_directory=dictionary_directory)
+    events = store.select()
+    hours = numpy.asarray(events.timestamps) // SECONDS
+    keys, counts = \
+      numpy.unique((events.project_ids.astype(numpy.int64) << 32) | hours,
+                   return_counts=True)
+    return keys >> 32, keys & 0xffffffff, counts
+
+  projects = string_ids.load('projects', dictionary_directory)
+  # (project_id, hour): request_count
+  cells = collections.Counter()
+
+  for batch in simple_log.read_batches(filepath, jobs=jobs, projects=True):
+    cells.update(zip(map(projects.get_id, batch.projects),
+                     [timestamp // SECONDS for timestamp in batch.timestamps]))
+
+  projects.save()
+
+  project_ids = numpy.fromiter((project_id for project_id, hour in cells),
+                               dtype=numpy.int64, count=len(cells))
+  hours = numpy.fromiter((hour for project_id, hour in cells),
+                         dtype=numpy.int64, count=len(cells))
+  counts = numpy.fromiter(cells.values(), dtype=numpy.int64, count=len(cells))
+  order = numpy.lexsort((hours, project_ids))
+  return project_ids[order], hours[order], counts[order]
+
+
+def build(filepath, jobs=1, dictionary_directory=string_ids.DIRECTORY):
+  source = get_source(filepath)
+  project_ids, hours, counts = count_cells(filepath, jobs,
+                                           dictionary_directory)
+
+  number_of_projects = \
+    len(string_ids.read_strings('projects', dictionary_directory))
+  cube = {
+    'offsets': numpy.searchsorted(project_ids,
+                                  numpy.arange(number_of_projects+1),
+                                  side='left').astype(numpy.int64),
+    'hours': hours.astype(numpy.int32),
+    'cumulative_counts': numpy.concatenate(([0], numpy.cumsum(counts)))\
+                              .astype(numpy.int64),
+  }
+
+  directory = get_cube_directory(filepath)
+  os.makedirs(directory, exist_ok=True)
+  for column in COLUMNS:
+    numpy.save(get_column_filepath(directory, column), cube[column])
+
+  with open(os.path.join(directory, SOURCE_FILENAME), 'wt') as source_file:
+    json.dump(source, source_file, sort_keys=True, indent=1)
+
+  return int(cube['cumulative_counts'][-1])
+
+
+class RequestCube:
+
+
+  def __init__(self, directory, dictionary_directory=string_ids.DIRECTORY):
+    for column in COLUMNS:
+      setattr(self, column, numpy.load(get_column_filepath(directory,
+                                                           column)))
+    self.dictionary_directory = dictionary_directory
+
+    # Cells sort by one key, so that every project can be searched at once.
+    self.key_size = int(self.hours.max())+2 if len(self.hours) else 1
+    project_ids = numpy.repeat(numpy.arange(len(self), dtype=numpy.int64),
+                               numpy.diff(self.offsets))
+    self.keys = project_ids*self.key_size + self.hours
+
+
+  # The number of project ids.
+  def __len__(self):
+    return len(self.offsets)-1
+
+
+  # The index of the first cell of every project at or after the hour of the
+  # timestamp, or the default indices if there is no timestamp.
+  def get_cell_indices(self, project_ids, timestamp, default):
+    if timestamp is None:
+      return default
+
+    assert timestamp % SECONDS == 0, timestamp
+    hour = min(max(timestamp // SECONDS, 0), self.key_size-1)
+    return numpy.searchsorted(self.keys, project_ids*self.key_size + hour,
+                              side='left')
+
+
+  # The number of requests of the project where since <= timestamp < until.
+  def count(self, project_id, since=None, until=None):
+    counts = self.get_counts(since, until,
+                             numpy.array([project_id], dtype=numpy.int64))
+    return int(counts[0])
+
+
+  # The number of requests of every (given) project id where
+  # since <= timestamp < until, as an array.
+  def get_counts(self, since=None, until=None, project_ids=None):
+    if project_ids is None:
+      project_ids = numpy.arange(len(self), dtype=numpy.int64)
+
+    start = self.get_cell_indices(project_ids, since,
+                                  self.offsets[project_ids])
+    stop = self.get_cell_indices(project_ids, until,
+                                 self.offsets[project_ids+1])
+    return self.cumulative_counts[stop] - self.cumulative_counts[start]
+
+
+  # project_name: request count, for every project with requests where
+  # since <= timestamp < until.
+  def get_project_counts(self, since=None, until=None):
+    projects = string_ids.read_strings('projects', self.dictionary_directory)
+    counts = self.get_counts(since, until)
+
+    return collections.Counter({projects[project_id]: int(counts[project_id])
+                                for project_id
+                                in numpy.flatnonzero(counts).tolist()})
+
+
+# The cube of the log, built first if it is missing, or older than the log.
+def load(filepath, jobs=1, dictionary_directory=string_ids.DIRECTORY):
+  if not is_up_to_date(filepath):
+    build(filepath, jobs, dictionary_directory)
+  return RequestCube(get_cube_directory(filepath), dictionary_directory)
+
+
+if __name__ == '__main__':
+  # rw for owner and group but not others
+  os.umask(0o07)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                      help='Number of processes that decode blocks')
+  parser.add_argument('--since', type=int)
+  parser.add_argument('--until', type=int)
+  parser.add_argument('--top', type=int, default=10)
+  parser.add_argument('filepath', nargs='?',
+                      default=SORTED_SIMPLE_LOG_FILEPATH)
+  args = parser.parse_args()
+
+  request_cube = load(args.filepath, args.jobs)
+  print('W {} ({:,} cells)'.format(get_cube_directory(args.filepath),
+                                   len(request_cube.hours)))
+
+  project_counts = request_cube.get_project_counts(args.since, args.until)
+  for project_name, count in project_counts.most_common(args.top):
+    print('{},{}'.format(project_name, count))
@@ -0,0 +1,130 @@
+'''
+Reads a sorted simple log in batches of records, one batch per decoded block,
+instead of one CSV row at a time.
+
+Every line is exactly as the Stripper wrote it:
+
+  "unix_timestamp","ip_address","url","user_agent"\n
+
+with no CSV quoting, so a whole block splits into fields with one str.split.
+A batch holds its fields as columns: lists, or, with arrays=True, NumPy arrays.
+'''
+
+
+# 1st-party
+import bisect
+import collections
+import functools
+
+# 3rd-party
+# Optional, used only for batches of arrays.
+# apt-get install python3-numpy
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# 2nd-party
+import partitioned_log
+import translation_cache
+
+
+FIELD_DELIMITER = '","'
+LINE_DELIMITER = '"\n"'
+NUMBER_OF_FIELDS = 4
+
+PROJECT_NAME_CACHE_SIZE = 1024*1024
+
+# Columns of the same length. projects is None unless asked for.
+Batch = collections.namedtuple('Batch', ('timestamps', 'ip_addresses', 'urls',
+                                         'user_agents', 'projects'))
+
+
+get_project_name = \
+  functools.lru_cache(maxsize=PROJECT_NAME_CACHE_SIZE)\
+                     (translation_cache.infer_package_name)
+
+
+# Returns [timestamp, ip_address, url, user_agent, ...] for all lines.
+def split_block(block):
+  text = block.decode('utf-8')
+  if not text.endswith('\n'):
+    text += '\n'
+  number_of_lines = text.count('\n')
+
+  # Glue the lines together, so that every delimiter is the same, and split
+  # them all at once.
+  fields = text[1:-2].replace(LINE_DELIMITER, FIELD_DELIMITER)\
+                     .split(FIELD_DELIMITER)
+
+  # Unless some user agent holds a delimiter, in which case split line by line,
+  # the user agent being the rest of the line.
+  if len(fields) != number_of_lines*NUMBER_OF_FIELDS:
+    fields = []
+    for line in text[:-1].split('\n'):
+      line_fields = line[1:-1].split(FIELD_DELIMITER, NUMBER_OF_FIELDS-1)
+      assert len(line_fields) == NUMBER_OF_FIELDS, line
+      fields.extend(line_fields)
+
+  return fields
+
+
+def read_batches(filepath, since=None, until=None, jobs=1, projects=False,
+                 arrays=False):
+  '''
+  parameters:
+    filepath:
+      either a directory of partitions, or a single (block) log, sorted.
+    since, until:
+      if not None, yield only records where since <= timestamp < until.
+    jobs:
+      number of processes that decode blocks in parallel.
+    projects:
+      whether to add a column of the project name of every URL.
+    arrays:
+      whether to yield columns as NumPy arrays (timestamps as int64, strings as
+      objects) instead of lists.
+
+  return:
+    A generator of Batches, in order of time.
+  '''
+
+  assert not arrays or numpy is not None, 'pip3 install numpy'
+
+  for block in partitioned_log.read_blocks(filepath, since, until, jobs):
+    fields = split_block(block)
+    timestamps = list(map(int, fields[0::NUMBER_OF_FIELDS]))
+
+    # Blocks at the edges of the time range may hold records outside it.
+    start = 0 if since is None else bisect.bisect_left(timestamps, since)
+    stop = len(timestamps) if until is None else \
+           bisect.bisect_left(timestamps, until)
+    if start >= stop:
+      continue
+
+    if start > 0 or stop < len(timestamps):
+      timestamps = timestamps[start:stop]
+      fields = fields[start*NUMBER_OF_FIELDS:stop*NUMBER_OF_FIELDS]
+
+    urls = fields[2::NUMBER_OF_FIELDS]
+    batch = Batch(timestamps, fields[1::NUMBER_OF_FIELDS], urls,
+                  fields[3::NUMBER_OF_FIELDS],
+                  list(map(get_project_name, urls)) if projects else None)
+
+    if arrays:
+      batch = Batch(numpy.array(batch.timestamps, dtype=numpy.int64),
+                    *(None if column is None
+                      else numpy.array(column, dtype=object)
+                      for column in batch[1:]))
+
+    yield batch
+
+
+# One record at a time, for consumers that must look at every one anyway:
+# (timestamp, ip_address, url, user_agent[, project]) tuples.
+def read_records(filepath, since=None, until=None, jobs=1, projects=False):
+  for batch in read_batches(filepath, since, until, jobs, projects):
+    if projects:
+      yield from zip(*batch)
+    else:
+      yield from zip(*batch[:-1])
@@ -0,0 +1,327 @@
+'''
+Aggregations by key (e.g., the set of projects of every IP address, or the
+downloads of every package by every IP address) that keep within a memory
+budget, however many keys there are.
+
+Keys and their aggregates are kept in a dict until the budget is exceeded.
+Then the keys are hash-partitioned, and every partition is spilled, sorted by
+key, to a run file on disk:
+
+  DIRECTORY/RUN.PARTITION.run
+
+In the end, items() merges the runs of every partition with what is still in
+memory, one partition at a time, reading only one record of every run at a
+time. Keys must be ints or strs, so that they sort, and partition the same
+way in every process.
+
+Aggregators can be checkpointed: get_state spills what is in memory, and
+returns the runs, which set_state resumes from.
+'''
+
+
+# 1st-party
+import heapq
+import itertools
+import operator
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+
+
+SPILL_DIRECTORY = '/var/experiments-output/spill'
+
+# In bytes.
+MEMORY_BUDGET = 1024*1024*1024
+# Rough sizes, in bytes, of what is kept in memory, measured with tracemalloc
+# on CPython 3.11. A key with one item takes 330-350 bytes (of the key, its
+# slot in the dict, and an empty set or dict), and every further item takes
+# 30-120 bytes (of the item, and its slot as the set or dict grows). Most keys
+# (e.g., IP addresses) have only one item.
+KEY_SIZE = 320
+ITEM_SIZE = 128
+
+NUMBER_OF_PARTITIONS = 16
+# Merge all runs into one when there are more than this many, so that merging
+# never opens too many files at once.
+MAX_NUMBER_OF_RUNS = 64
+# Pickle records in chunks of this many.
+CHUNK_SIZE = 4096
+
+
+def get_partition(key, number_of_partitions=NUMBER_OF_PARTITIONS):
+  # Unlike hash(), the same in every process.
+  if isinstance(key, int):
+    return key % number_of_partitions
+  return zlib.crc32(key.encode('utf-8')) % number_of_partitions
+
+
+# Sorted (key, aggregate) records, one chunk at a time.
+def read_run(filepath):
+  with open(filepath, 'rb') as run_file:
+    while True:
+      try:
+        chunk = pickle.load(run_file)
+      except EOFError:
+        return
+      yield from chunk
+
+
+def write_run(filepath, records):
+  with open(filepath, 'wb') as run_file:
+    records = iter(records)
+    while True:
+      chunk = list(itertools.islice(records, CHUNK_SIZE))
+      if not chunk:
+        break
+      pickle.dump(chunk, run_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    run_file.flush()
+    os.fsync(run_file.fileno())
+
+
+class SpillAggregator:
+  '''
+  The base of aggregators. Subclasses say how to add an item to an aggregate,
+  and how to merge two aggregates of the same key.
+  '''
+
+
+  def __init__(self, memory_budget=MEMORY_BUDGET, directory=None,
+               number_of_partitions=NUMBER_OF_PARTITIONS):
+    self.memory_budget = memory_budget
+    self.number_of_partitions = number_of_partitions
+    # Made only when there is something to spill, unless given.
+    self.directory = directory
+    self.is_temporary_directory = directory is None
+
+    # key: aggregate
+    self.aggregates = {}
+    # The estimated size of the keys and aggregates in memory.
+    self.size = 0
+    # Ids of the runs on disk, in order.
+    self.runs = []
+    self.next_run = 0
+    # Ids of the runs in the last state, which must be kept until the next
+    # state is saved instead.
+    self.state_runs = set()
+    # Ids of runs merged into others, but in a state that may be the last one
+    # saved.
+    self.merged_runs = set()
+
+
+  def new_aggregate(self):
+    raise NotImplementedError()
+
+
+  # Merge the other aggregate into this one, and return it.
+  def merge_aggregates(self, aggregate, other_aggregate):
+    raise NotImplementedError()
+
+
+  # The aggregate of the key, made if it is new.
+  def get_aggregate(self, key):
+    aggregate = self.aggregates.get(key)
+
+    if aggregate is None:
+      aggregate = self.new_aggregate()
+      self.aggregates[key] = aggregate
+      self.size += KEY_SIZE
+
+    return aggregate
+
+
+  # Subclasses call this with the number of items they added to aggregates.
+  def added(self, number_of_items):
+    self.size += number_of_items*ITEM_SIZE
+
+    if self.size > self.memory_budget:
+      self.spill()
+
+
+  def get_run_filepath(self, run, partition):
+    return os.path.join(self.directory, '{}.{}.run'.format(run, partition))
+
+
+  # The records of every partition, sorted by key.
+  def get_partitions(self):
+    partitions = [[] for partition in range(self.number_of_partitions)]
+
+    for key, aggregate in self.aggregates.items():
+      partitions[get_partition(key, self.number_of_partitions)]\
+                .append((key, aggregate))
+
+    for records in partitions:
+      records.sort(key=operator.itemgetter(0))
+
+    return partitions
+
+
+  def remove_runs(self, runs):
+    for run in runs:
+      for partition in range(self.number_of_partitions):
+        filepath = self.get_run_filepath(run, partition)
+        if os.path.exists(filepath):
+          os.remove(filepath)
+
+
+  # Write what is in memory to a new run, and forget it.
+  def spill(self):
+    if not self.aggregates:
+      return
+
+    if self.directory is None:
+      os.makedirs(SPILL_DIRECTORY, exist_ok=True)
+      self.directory = tempfile.mkdtemp(prefix='aggregator-',
+                                        dir=SPILL_DIRECTORY)
+    os.makedirs(self.directory, exist_ok=True)
+
+    run = self.next_run
+    for partition, records in enumerate(self.get_partitions()):
+      write_run(self.get_run_filepath(run, partition), records)
+
+    self.runs.append(run)
+    self.next_run += 1
+    self.aggregates = {}
+    self.size = 0
+
+    if len(self.runs) > MAX_NUMBER_OF_RUNS:
+      self.compact()
+
+
+  # Merge all runs into a new one.
+  def compact(self):
+    run = self.next_run
+
+    for partition in range(self.number_of_partitions):
+      write_run(self.get_run_filepath(run, partition),
+                self.merge_partition(partition, []))
+
+    # Runs that no state refers to are removed at once.
+    self.merged_runs.update(self.runs)
+    self.remove_runs(self.merged_runs - self.state_runs)
+    self.merged_runs &= self.state_runs
+    self.runs = [run]
+    self.next_run += 1
+
+
+  # (key, aggregate) for every key of the partition, from all runs and the
+  # given records in memory, sorted by key.
+  def merge_partition(self, partition, records):
+    sorted_records = [read_run(self.get_run_filepath(run, partition))
+                      for run in self.runs]
+    sorted_records.append(records)
+
+    for key, key_records in \
+        itertools.groupby(heapq.merge(*sorted_records,
+                                      key=operator.itemgetter(0)),
+                          key=operator.itemgetter(0)):
+      key, aggregate = next(key_records)
+      for other_key, other_aggregate in key_records:
+        aggregate = self.merge_aggregates(aggregate, other_aggregate)
+      yield key, aggregate
+
+
+  # (key, aggregate) for every key, one partition at a time. Keys are sorted
+  # only within partitions.
+  def items(self):
+    if not self.runs:
+      yield from self.aggregates.items()
+      return
+
+    for partition, records in enumerate(self.get_partitions()):
+      yield from self.merge_partition(partition, records)
+
+
+  # The state must be saved before get_state is called again, since only the
+  # runs of the last state are kept.
+  def get_state(self):
+    self.spill()
+
+    # The last state is saved, and it alone may still be resumed from, until
+    # this one is saved instead. Its runs are removed once merged after that.
+    self.remove_runs(self.merged_runs - self.state_runs)
+    self.merged_runs = self.state_runs - set(self.runs)
+    self.state_runs = set(self.runs)
+
+    return {
+      'directory': self.directory,
+      'is_temporary_directory': self.is_temporary_directory,
+      'runs': list(self.runs),
+      'next_run': self.next_run,
+    }
+
+
+  def set_state(self, state):
+    self.directory = state['directory']
+    self.is_temporary_directory = state['is_temporary_directory']
+    self.runs = list(state['runs'])
+    self.next_run = state['next_run']
+    self.state_runs = set(self.runs)
+    self.merged_runs = set()
+    self.aggregates = {}
+    self.size = 0
+
+
+  # Remove the runs, if they are in a directory of our own.
+  def close(self):
+    if self.is_temporary_directory and self.directory is not None and \
+       os.path.isdir(self.directory):
+      shutil.rmtree(self.directory)
+
+    self.directory = None
+    self.aggregates = {}
+    self.size = 0
+    self.runs = []
+    self.state_runs = set()
+    self.merged_runs = set()
+
+
+class SetAggregator(SpillAggregator):
+  '''
+  key: set(item)
+  '''
+
+
+  def new_aggregate(self):
+    return set()
+
+
+  def merge_aggregates(self, aggregate, other_aggregate):
+    aggregate |= other_aggregate
+    return aggregate
+
+
+  def add(self, key, item):
+    aggregate = self.get_aggregate(key)
+    number_of_items = len(aggregate)
+    aggregate.add(item)
+    self.added(len(aggregate)-number_of_items)
+
+
+class CounterAggregator(SpillAggregator):
+  '''
+  key: {item: count}
+  '''
+
+
+  def new_aggregate(self):
+    return {}
+
+
+  def merge_aggregates(self, aggregate, other_aggregate):
+    for item, count in other_aggregate.items():
+      aggregate[item] = aggregate.get(item, 0) + count
+    return aggregate
+
+
+  def add(self, key, item, count=1):
+    aggregate = self.get_aggregate(key)
+    old_count = aggregate.get(item)
+
+    if old_count is None:
+      aggregate[item] = count
+      self.added(1)
+    else:
+      aggregate[item] = old_count + count
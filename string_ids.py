@@ -0,0 +1,203 @@
+'''
+Persistent, append-only dictionaries that give every string (an IP address, a
+user agent, a URL, a project name) an integer id, shared by every tool:
+
+  /var/experiments-output/dictionaries/ip_addresses.txt
+  /var/experiments-output/dictionaries/projects.txt
+  /var/experiments-output/dictionaries/urls.txt
+  /var/experiments-output/dictionaries/user_agents.txt
+
+The string on line i has id i. Strings are only ever added to the end, so an
+id, once saved, means the same string forever, and tools can keep ids (in
+arrays, or sets of ints) instead of strings, and exchange them.
+
+New ids are given out only under the lock of the file, so tools may give them
+out at the same time. A tool takes the lock at its first new string, and holds
+it while it gives out a batch of new ids, which it then appends with one write.
+'''
+
+
+# 1st-party
+import fcntl
+import os
+import time
+
+
+DIRECTORY = '/var/experiments-output/dictionaries'
+
+# Append new strings, and let go of the lock, once there are this many, or
+# this many seconds after taking the lock, whichever comes first.
+BATCH_SIZE = 64*1024
+BATCH_SECONDS = 1
+
+# The StringIds of this process that hold the lock of their file.
+LOCKED_STRING_IDS = set()
+
+
+def get_filepath(name, directory=DIRECTORY):
+  return os.path.join(directory, name + '.txt')
+
+
+# Just the strings, by id, for tools that need not give out new ids.
+def read_strings(name, directory=DIRECTORY):
+  with open(get_filepath(name, directory), 'rt', encoding='utf-8',
+            newline='\n') as dictionary_file:
+    return [line[:-1] for line in dictionary_file if line.endswith('\n')]
+
+
+class StringIds:
+
+
+  # Without a filepath, the ids are only good for this process.
+  def __init__(self, filepath=None):
+    self.filepath = filepath
+    # string: id
+    self.ids = {}
+    # id: string
+    self.strings = []
+    # How many bytes of the file are read into, or written from, the strings.
+    self.saved_size = 0
+    # Opened only to give out new ids.
+    self.fd = None
+    # While locked, the lines of the new strings, and when to append them.
+    self.is_locked = False
+    self.batch = []
+    self.batch_deadline = None
+
+    if filepath is not None and os.path.exists(filepath):
+      with open(filepath, 'rb') as dictionary_file:
+        self.read_lines(dictionary_file)
+
+
+  def __len__(self):
+    return len(self.strings)
+
+
+  def __contains__(self, string):
+    return string in self.ids
+
+
+  def __getitem__(self, id):
+    return self.strings[id]
+
+
+  def add(self, string):
+    id = len(self.strings)
+    self.ids[string] = id
+    self.strings.append(string)
+    return id
+
+
+  # Add the strings of whole lines past saved_size, which other processes
+  # may have appended.
+  def read_lines(self, dictionary_file):
+    for line in dictionary_file:
+      # A process that was killed may have left half a line.
+      if not line.endswith(b'\n'):
+        break
+      self.add(line[:-1].decode('utf-8'))
+      self.saved_size += len(line)
+
+
+  # Gives the string an id, if it has none yet.
+  def get_id(self, string):
+    id = self.ids.get(string)
+
+    if id is None:
+      if self.filepath is None:
+        id = self.add(string)
+      else:
+        id = self.append(string)
+
+    # Do not keep others waiting for the lock when there are no new strings.
+    elif self.is_locked and time.monotonic() >= self.batch_deadline:
+      self.flush()
+
+    return id
+
+
+  # Ids must mean the same to everyone, so new ids are given out only under
+  # the lock of the file, and only after the ids that other processes gave
+  # out before.
+  def lock(self):
+    if self.fd is None:
+      self.fd = os.open(self.filepath, os.O_RDWR | os.O_CREAT, 0o660)
+
+    try:
+      fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      # Never wait while holding another lock, which the holder of this one
+      # may be waiting for.
+      for string_ids in list(LOCKED_STRING_IDS):
+        string_ids.flush()
+      fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    self.is_locked = True
+    self.batch_deadline = time.monotonic() + BATCH_SECONDS
+    LOCKED_STRING_IDS.add(self)
+
+    if os.fstat(self.fd).st_size > self.saved_size:
+      with open(self.fd, 'rb', closefd=False) as dictionary_file:
+        dictionary_file.seek(self.saved_size)
+        self.read_lines(dictionary_file)
+
+
+  def append(self, string):
+    assert '\n' not in string, string
+
+    if not self.is_locked:
+      self.lock()
+      # Another process may have given it an id in the meantime.
+      id = self.ids.get(string)
+      if id is not None:
+        return id
+
+    id = self.add(string)
+    self.batch.append(string.encode('utf-8') + b'\n')
+
+    if len(self.batch) >= BATCH_SIZE or \
+       time.monotonic() >= self.batch_deadline:
+      self.flush()
+
+    return id
+
+
+  # Append the batch of new strings, and let go of the lock.
+  def flush(self):
+    if not self.is_locked:
+      return
+
+    try:
+      if self.batch:
+        # Overwrite half a line, if any.
+        if os.fstat(self.fd).st_size > self.saved_size:
+          os.ftruncate(self.fd, self.saved_size)
+        data = b''.join(self.batch)
+        os.pwrite(self.fd, data, self.saved_size)
+        self.saved_size += len(data)
+        self.batch = []
+
+    finally:
+      fcntl.flock(self.fd, fcntl.LOCK_UN)
+      self.is_locked = False
+      LOCKED_STRING_IDS.discard(self)
+
+
+  # None if the string has no id.
+  def find(self, string):
+    return self.ids.get(string)
+
+
+  # Make the ids that were given out durable.
+  def save(self):
+    assert self.filepath is not None
+
+    self.flush()
+    if self.fd is not None:
+      os.fsync(self.fd)
+
+
+# The shared dictionary of the given name: e.g., 'ip_addresses'.
+def load(name, directory=DIRECTORY):
+  os.makedirs(directory, exist_ok=True)
+  return StringIds(get_filepath(name, directory))
@@ -3,7 +3,6 @@
 
 # 1st-party
 import json
-import lzma
 import os
 import re
 import urllib.error
@@ -11,6 +10,10 @@ import urllib.request
 
 import xmlrpc.client as xmlrpclib
 
+# 2nd-party
+import checkpoint
+import compression
+
 
 EPSILON = ''
 SLASH = '/'
@@ -19,6 +22,8 @@ PROJECT_URL_REGEX = re.compile(r'^/packages/(.+)/(.+)/(.+)/(.+)$')
 
 TRANSLATION_CACHE_FILENAME = '/var/experiments-output/translation_cache.json'
 SIMPLE_LOG_FILENAME = '/var/experiments-output/simple/sorted.simple.log.xz'
+# Where to resume _build_redirection_cache from, if it was interrupted.
+CHECKPOINT_FILENAME = TRANSLATION_CACHE_FILENAME + '.checkpoint'
 
 
 def infer_package_name(path):
@@ -50,19 +55,19 @@ class pypi_translation_cache:
       return self.translation_dict[project_name]
 
     elif self.should_translate_from_upstream:
-      req = urllib2.request.Request('https://pypi.python.org/simple/{}/'.\
+      req = urllib.request.Request('https://pypi.python.org/simple/{}/'.\
                                     format(project_name))
       # http://stackoverflow.com/a/4421485
       req.get_method = lambda: 'HEAD'
 
       try:
-        res = urllib2.request.urlopen(req)
+        res = urllib.request.urlopen(req)
         redirection = res.geturl()
         translated_name = re.match('^https://pypi.python.org/simple/([^/]*)/$',
                                    redirection).group(1).strip(SLASH)
         assert SLASH not in translated_name
 
-      except urllib2.error.HTTPError as e:
+      except urllib.error.HTTPError as e:
         translated_name = None
 
       self.translation_dict[project_name] = translated_name
@@ -79,25 +84,39 @@ class pypi_translation_cache:
 
 # since the first time the cache takes a while to populate, we should 
 # run this script to initialize the local file.
+# Since the cache is dumped with every checkpoint, an interrupted run resumes
+# from the last checkpoint.
 def _build_redirection_cache():
   cache = pypi_translation_cache(True)
   minicache = set() 
+  progress = checkpoint.Checkpoint(CHECKPOINT_FILENAME)
+
+  with compression.open(SIMPLE_LOG_FILENAME, 'rb') as fp:
+    i = progress.get('line_counter', 0)
+    # Uncompressed bytes of the lines seen so far.
+    offset = progress.get('offset', 0)
+    checkpoint.skip(fp, offset)
 
-  with lzma.open(SIMPLE_LOG_FILENAME, 'rt') as fp:
-    i = 0
+    for line in fp:
+      event = line.decode('utf-8')
 
-    for event in fp:
       try:
         request = event.split(',')[2]
         package_name = infer_package_name(request)
         result = cache.translate(package_name)
 
       except Exception as e:
-        cache.dump(filename)
+        cache.dump(TRANSLATION_CACHE_FILENAME)
+        progress.save(line_counter=i, offset=offset)
         print("{}: {}".format(i, e))
         raise
 
       i += 1
+      offset += len(line)
+
+      if progress.is_due():
+        cache.dump(TRANSLATION_CACHE_FILENAME)
+        progress.save(line_counter=i, offset=offset)
 
       if result is None and result not in minicache:
         print("Not found: {}".format(package_name))
@@ -108,7 +127,8 @@ def _build_redirection_cache():
         print(" At line: {}".format(i))
         print("=============================")
 
-  cache.dump(filename)
+  cache.dump(TRANSLATION_CACHE_FILENAME)
+  progress.remove()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+'''
+An index of the download timestamps of every URL of the sorted simple log,
+materialized next to the log, so that counting the downloads of a URL before
+some time is a binary search of one array instead of a scan of the log:
+
+  SORTED_SIMPLE_LOG.urls/offsets.npy          int64, one per URL id + 1
+  SORTED_SIMPLE_LOG.urls/first_timestamps.npy int64, one per URL id
+  SORTED_SIMPLE_LOG.urls/deltas.npy           int32, one per download
+
+The downloads of URL u are offsets[u]:offsets[u+1], in order of time. Every
+delta is the number of seconds since the previous download of the same URL
+(0 for the first one), so the timestamps of u are first_timestamps[u] plus the
+cumulative sum of its deltas.
+
+URL ids are those of the shared dictionaries of string_ids.
+
+USAGE: python3 url_index.py [-j JOBS] [SORTED_SIMPLE_LOG]
+Builds the index of SORTED_SIMPLE_LOG (a block log, a directory of partitions,
+or an event store), if it is not up to date.
+'''
+
+
+# 1st-party
+import argparse
+import array
+import json
+import os
+
+# 3rd-party
+import numpy
+
+# 2nd-party
+import event_store
+import request_cube
+import simple_log
+import string_ids
+
+
+SORTED_SIMPLE_LOG_FILEPATH = \
+  '/var/experiments-output/simple/sorted.simple.log.xz'
+INDEX_EXTENSION = '.urls'
+
+# column: dtype
+COLUMNS = (
+  ('offsets', 'int64'),
+  ('first_timestamps', 'int64'),
+  ('deltas', 'int32'),
+)
+# The log, and its mtime, as of the last build.
+SOURCE_FILENAME = 'source.json'
+
+
+def get_index_directory(filepath):
+  return filepath.rstrip(os.sep) + INDEX_EXTENSION
+
+
+def get_column_filepath(directory, column):
+  return os.path.join(directory, column + '.npy')
+
+
+def is_up_to_date(filepath):
+  source_filepath = os.path.join(get_index_directory(filepath),
+                                 SOURCE_FILENAME)
+  if not os.path.exists(source_filepath):
+    return False
+
+  with open(source_filepath, 'rt') as source_file:
+    return json.load(source_file) == request_cube.get_source(filepath)
+
+
+# The URL id and timestamp of every download, in order of time.
+def read_downloads(filepath, jobs=1, dictionary_directory=string_ids.DIRECTORY):
+  if event_store.is_event_store(filepath):
+    store = event_store.EventStore(filepath,
+                                   dictionary_directory=dictionary_directory)
+    events = store.select()
+    return numpy.asarray(events.url_ids), numpy.asarray(events.timestamps)
+
+  urls = string_ids.load('urls', dictionary_directory)
+  url_ids = array.array('i')
+  timestamps = array.array('q')
+
+  for batch in simple_log.read_batches(filepath, jobs=jobs):
+    url_ids.extend(map(urls.get_id, batch.urls))
+    timestamps.extend(batch.timestamps)
+
+  urls.save()
+  return numpy.frombuffer(url_ids, dtype=numpy.int32), \
+         numpy.frombuffer(timestamps, dtype=numpy.int64)
+
+
+def build(filepath, jobs=1, dictionary_directory=string_ids.DIRECTORY):
+  source = request_cube.get_source(filepath)
+  url_ids, timestamps = read_downloads(filepath, jobs, dictionary_directory)
+  assert numpy.all(timestamps[1:] >= timestamps[:-1]), 'log is not sorted'
+
+  # A stable sort by URL keeps the downloads of every URL in order of time.
+  order = numpy.argsort(url_ids, kind='stable')
+  url_ids = url_ids[order]
+  timestamps = timestamps[order]
+
+  number_of_urls = len(string_ids.read_strings('urls', dictionary_directory))
+  offsets = numpy.searchsorted(url_ids, numpy.arange(number_of_urls+1),
+                               side='left').astype(numpy.int64)
+
+  first_timestamps = numpy.zeros(number_of_urls, dtype=numpy.int64)
+  has_downloads = offsets[:-1] < offsets[1:]
+  first_timestamps[has_downloads] = timestamps[offsets[:-1][has_downloads]]
+
+  deltas = numpy.diff(timestamps, prepend=0)
+  # The first download of every URL is its first timestamp.
+  deltas[offsets[:-1][has_downloads]] = 0
+  assert numpy.all(deltas <= numpy.iinfo(numpy.int32).max)
+
+  index = {
+    'offsets': offsets,
+    'first_timestamps': first_timestamps,
+    'deltas': deltas,
+  }
+
+  directory = get_index_directory(filepath)
+  os.makedirs(directory, exist_ok=True)
+  for column, dtype in COLUMNS:
+    numpy.save(get_column_filepath(directory, column),
+               index[column].astype(dtype))
+
+  with open(os.path.join(directory, SOURCE_FILENAME), 'wt') as source_file:
+    json.dump(source, source_file, sort_keys=True, indent=1)
+
+  return len(deltas)
+
+
+class URLIndex:
+
+
+  def __init__(self, directory, dictionary_directory=string_ids.DIRECTORY):
+    for column, dtype in COLUMNS:
+      setattr(self, column, numpy.load(get_column_filepath(directory, column),
+                                       mmap_mode='r'))
+    self.urls = string_ids.load('urls', dictionary_directory)
+    # filename: [url_id, ...], built only when needed.
+    self.filename_url_ids = None
+
+
+  # The number of URL ids.
+  def __len__(self):
+    return len(self.first_timestamps)
+
+
+  # The ids of the URL, or of every URL of the package filename: e.g.,
+  # 'django-cms-2.4.3.tar.gz'.
+  def get_url_ids(self, url_or_filename):
+    if url_or_filename.startswith('/'):
+      url_id = self.urls.find(url_or_filename)
+      return [] if url_id is None or url_id >= len(self) else [url_id]
+
+    if self.filename_url_ids is None:
+      self.filename_url_ids = {}
+      for url_id in range(len(self)):
+        url = self.urls[url_id]
+        if url.startswith('/packages/'):
+          self.filename_url_ids.setdefault(os.path.basename(url), [])\
+                               .append(url_id)
+
+    return self.filename_url_ids.get(url_or_filename, [])
+
+
+  # The timestamps of every download of the URL id, in order.
+  def get_timestamps(self, url_id):
+    start, stop = self.offsets[url_id], self.offsets[url_id+1]
+    return self.first_timestamps[url_id] + \
+           numpy.cumsum(self.deltas[start:stop], dtype=numpy.int64)
+
+
+  # The timestamps of every download of the URL or package filename, in order.
+  def get_downloads(self, url_or_filename):
+    timestamps = [self.get_timestamps(url_id)
+                  for url_id in self.get_url_ids(url_or_filename)]
+    if len(timestamps) == 1:
+      return timestamps[0]
+    return numpy.sort(numpy.concatenate(timestamps or
+                                        [numpy.zeros(0, dtype=numpy.int64)]))
+
+
+  # The number of downloads of the URL or package filename where
+  # since <= timestamp < until.
+  def count(self, url_or_filename, since=None, until=None):
+    timestamps = self.get_downloads(url_or_filename)
+    start = 0 if since is None else \
+            int(numpy.searchsorted(timestamps, since, side='left'))
+    stop = len(timestamps) if until is None else \
+           int(numpy.searchsorted(timestamps, until, side='left'))
+    return max(stop-start, 0)
+
+
+# The index of the log, built first if it is missing, or older than the log.
+def load(filepath, jobs=1, dictionary_directory=string_ids.DIRECTORY):
+  if not is_up_to_date(filepath):
+    build(filepath, jobs, dictionary_directory)
+  return URLIndex(get_index_directory(filepath), dictionary_directory)
+
+
+if __name__ == '__main__':
+  # rw for owner and group but not others
+  os.umask(0o07)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                      help='Number of processes that decode blocks')
+  parser.add_argument('filepath', nargs='?',
+                      default=SORTED_SIMPLE_LOG_FILEPATH)
+  args = parser.parse_args()
+
+  url_index = load(args.filepath, args.jobs)
+  print('W {} ({:,} downloads of {:,} URLs)'\
+        .format(get_index_directory(args.filepath), len(url_index.deltas),
+                len(url_index)))
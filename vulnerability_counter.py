@@ -2,14 +2,18 @@
 
 
 # 1st-party
-import csv
 import logging
 import math
 import os
 import sys
 
+# 3rd-party
+import numpy
+
 # 2nd-party
-import translation_cache
+import event_store
+import simple_log
+import string_ids
 
 
 # The experiment is only valid since the following Unix timestamp.
@@ -22,25 +26,37 @@ NUMBER_OF_SECONDS_IN_A_DAY = 24*60*60
 # either the unsafe set or the safe set, dumps the total number of users in one
 # column and the numbers of users affected; we will also have a first column
 # representing the unix timestamp for each row.
-def traverse_event_log(simple_log_filename, safe_packages, unsafe_packages):
+# If since or until is not None, traverse only requests where
+# since <= timestamp < until, reading only the partitions that hold them.
+# The log may also be an event store, which is traversed with arrays.
+def traverse_event_log(simple_log_filename, safe_packages, unsafe_packages,
+                       since=None, until=None):
+  if event_store.is_event_store(simple_log_filename):
+    return traverse_event_store(simple_log_filename, safe_packages,
+                                unsafe_packages, since, until)
+
   # day number (int): unsafe user count (int)
   day_number_to_unsafe_user_count = {}
-  missed_packages, total_users, unsafe_users = set(), set(), set()
+  # Users are the ids of their IP addresses in the shared dictionary, so that
+  # all users, and unsafe users, are sets of ints.
+  ip_addresses = string_ids.load('ip_addresses')
+  missed_packages, users, unsafe_users = set(), set(), set()
   missed_requests, total_requests = 0, 0
   prev_timestamp = None
   prev_unsafe_user_count = 0
 
-  with open(simple_log_filename, 'rt') as simple_log_file:
-    simple_log_file = csv.reader(simple_log_file)
-
-    for timestamp, ip_address, url, user_agent in simple_log_file:
-      package_name = translation_cache.infer_package_name(url)
+  for batch in simple_log.read_batches(simple_log_filename, since, until,
+                                       projects=True):
+    for timestamp, ip_address, package_name in \
+        zip(batch.timestamps, batch.ip_addresses, batch.projects):
+      ip_address_id = ip_addresses.get_id(ip_address)
+      users.add(ip_address_id)
 
       if package_name in safe_packages:
         assert package_name not in unsafe_packages
 
       else:
-        unsafe_users.add(ip_address)
+        unsafe_users.add(ip_address_id)
 
         if package_name not in unsafe_packages:
           missed_packages.add(package_name)
@@ -53,11 +69,9 @@ def traverse_event_log(simple_log_filename, safe_packages, unsafe_packages):
       assert prev_unsafe_user_count <= unsafe_user_count
       prev_unsafe_user_count = unsafe_user_count
 
-      total_users.add(ip_address)
-      total_user_count = len(total_users)
+      total_user_count = len(users)
       assert unsafe_user_count <= total_user_count
 
-      timestamp = int(timestamp)
       if prev_timestamp is None:
         prev_timestamp = timestamp
       assert prev_timestamp <= timestamp
@@ -66,6 +80,57 @@ def traverse_event_log(simple_log_filename, safe_packages, unsafe_packages):
       day_number = (timestamp-SINCE_TIMESTAMP) // NUMBER_OF_SECONDS_IN_A_DAY
       day_number_to_unsafe_user_count[day_number] = unsafe_user_count
 
+  ip_addresses.save()
+
+  return get_points(day_number_to_unsafe_user_count, missed_packages,
+                    missed_requests, total_requests, unsafe_user_count,
+                    total_user_count)
+
+
+# The same as traverse_event_log, but over the columns of an event store.
+def traverse_event_store(event_store_directory, safe_packages,
+                         unsafe_packages, since=None, until=None):
+  store = event_store.EventStore(event_store_directory)
+  events = store.select(since, until)
+  projects = store.get_strings('projects')
+
+  # project_id: whether the project is safe (or unsafe)
+  safe_projects = store.get_mask('projects', safe_packages)
+  unsafe_projects = store.get_mask('projects', unsafe_packages)
+  assert not (safe_projects & unsafe_projects).any()
+
+  timestamps = numpy.asarray(events.timestamps)
+  assert (timestamps[:-1] <= timestamps[1:]).all()
+  project_ids = numpy.asarray(events.project_ids)
+  ip_address_ids = numpy.asarray(events.ip_address_ids)
+
+  unsafe_requests = ~safe_projects[project_ids]
+  missed_requests = unsafe_requests & ~unsafe_projects[project_ids]
+  missed_packages = set(projects[project_id] for project_id in
+                        numpy.unique(project_ids[missed_requests]))
+
+  # The day on which every unsafe user first asked for an unsafe project.
+  day_numbers = (timestamps-SINCE_TIMESTAMP) // NUMBER_OF_SECONDS_IN_A_DAY
+  unsafe_ip_address_ids, first_requests = \
+    numpy.unique(ip_address_ids[unsafe_requests], return_index=True)
+  first_day_numbers = numpy.sort(day_numbers[unsafe_requests][first_requests])
+
+  # Like the log, count unsafe users as of every day that saw any request.
+  request_day_numbers = numpy.unique(day_numbers)
+  unsafe_user_counts = numpy.searchsorted(first_day_numbers,
+                                          request_day_numbers, side='right')
+  day_number_to_unsafe_user_count = \
+    dict(zip(request_day_numbers.tolist(), unsafe_user_counts.tolist()))
+
+  return get_points(day_number_to_unsafe_user_count, missed_packages,
+                    int(missed_requests.sum()), len(timestamps),
+                    len(unsafe_ip_address_ids),
+                    len(numpy.unique(ip_address_ids)))
+
+
+def get_points(day_number_to_unsafe_user_count, missed_packages,
+               missed_requests, total_requests, unsafe_user_count,
+               total_user_count):
   missed_percentage = (missed_requests/total_requests)*100
   assert missed_percentage >= 0, 'Missed {}%'.format(missed_percentage)
   assert missed_percentage < 1, 'Missed {}%'.format(missed_percentage)
@@ -83,7 +148,7 @@ def traverse_event_log(simple_log_filename, safe_packages, unsafe_packages):
   assert len(day_number_to_unsafe_user_count) == NUMBER_OF_DAYS
   # Now we return the number of vulnerable users per day with a list.
   points = [day_number_to_unsafe_user_count[j] for j in range(NUMBER_OF_DAYS)]
-  return points 
+  return points
 
 
 if __name__ == '__main__':
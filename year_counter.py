@@ -2,15 +2,14 @@
 
 
 import collections
-import csv
-from datetime import datetime
-import json
+import itertools
 
-import translation_cache
-import package_cache
+import numpy
+
+import project_table
+import simple_log
 
 
-PACKAGE_TIMESTAMPS_FILENAME = '/var/experiments-output/package_cache.json'
 DOWNLOAD_LOG_FILENAME = '/var/experiments-output/simple/sorted.packages.log.4'
 
 # The experiment is only valid since the following Unix timestamp.
@@ -18,27 +17,36 @@ SINCE_TIMESTAMP = 1395360000
 UNTIL_TIMESTAMP = 1397952000
 
 
-with open(PACKAGE_TIMESTAMPS_FILENAME) as package_timestamps_json:
-  project_timestamps = json.load(package_timestamps_json)
+# Years and months of an array of Unix timestamps.
+def get_years(timestamps):
+  return timestamps.astype('datetime64[s]').astype('datetime64[Y]')\
+                   .astype('int64') + 1970
 
-projects_last_updated_in_year = collections.Counter()
-projects_last_updated_in_2014_last_updated_in_month = collections.Counter()
 
-for timestamps in project_timestamps.values():
-  # We are looking only at projects did update before compromise.
-  last_updated_timestamp = \
-            package_cache.get_last_timestamp_before_compromise(timestamps,
-                                                               SINCE_TIMESTAMP)
+def get_months(timestamps):
+  return timestamps.astype('datetime64[s]').astype('datetime64[M]')\
+                   .astype('int64') % 12 + 1
 
-  if last_updated_timestamp:
-    last_updated_datetime = datetime.utcfromtimestamp(last_updated_timestamp)
-    last_updated_year = last_updated_datetime.year
-    projects_last_updated_in_year[last_updated_year] += 1
 
-    if last_updated_year == 2014:
-      last_updated_month = last_updated_datetime.month
-      projects_last_updated_in_2014_last_updated_in_month[
-                                                      last_updated_month] += 1
+# Count the years of the timestamps, and the months of those in 2014.
+def count(timestamps, years_counter, months_counter):
+  years = get_years(timestamps)
+  years_counter.update(years.tolist())
+  months_counter.update(get_months(timestamps[years == 2014]).tolist())
+
+
+table = project_table.load('in_package_cache', 'last_timestamps',
+                           'first_timestamps')
+assert project_table.SINCE_TIMESTAMP == SINCE_TIMESTAMP
+
+projects_last_updated_in_year = collections.Counter()
+projects_last_updated_in_2014_last_updated_in_month = collections.Counter()
+
+# We are looking only at projects did update before compromise.
+last_updated_timestamps = table.last_timestamps[table.in_package_cache]
+count(last_updated_timestamps[last_updated_timestamps > 0],
+      projects_last_updated_in_year,
+      projects_last_updated_in_2014_last_updated_in_month)
 
 print('All projects last updated before compromise in these years:')
 print(projects_last_updated_in_year)
@@ -54,50 +62,42 @@ dloaded_projects_last_updated_in_2014_last_updated_in_month = \
 future_projects = set()
 missing_projects = set()
 
-with open(DOWNLOAD_LOG_FILENAME) as download_log:
-  download_log = csv.reader(download_log)
-
-  for timestamp, ip_address, package_url, user_agent in download_log:
-    timestamp = int(timestamp)
-    project_name = translation_cache.infer_package_name(package_url)
-
-    try:
-      timestamps = project_timestamps[project_name]
-    except KeyError:
-      # NOTE: Probably the entire project was deleted after compromise but
-      # before now.
-      missing_projects.add(project_name)
-      continue
-    else:
-      # We are looking only at projects did update before compromise.
-      last_updated_timestamp = \
-            package_cache.get_last_timestamp_before_compromise(timestamps,
-                                                               SINCE_TIMESTAMP)
-
-      # Project was not updated before compromise.
-      if not last_updated_timestamp:
-        # Misnomer, but actually the first time package was updated after
-        # compromise.
-        last_updated_timestamp = timestamps[0]
-
-        # Question: Why is the user downloading a package from a project that
-        # *seems* to have been last updated in the future?
-        # Answer: Some of these packages seem to have been deleted.  For
-        # example, a user downloaded sparsehash-0.11 which does not exist on
-        # PyPI anymore, and the earliest known package now is sparsehash-0.3
-        # which was updated after the compromise.
-        if last_updated_timestamp > UNTIL_TIMESTAMP:
-          future_projects.add(project_name)
-
-      last_updated_datetime = \
-                            datetime.utcfromtimestamp(last_updated_timestamp)
-      last_updated_year = last_updated_datetime.year
-      dloaded_projects_last_updated_in_year[last_updated_year] += 1
-
-      if last_updated_year == 2014:
-        last_updated_month = last_updated_datetime.month
-        dloaded_projects_last_updated_in_2014_last_updated_in_month[
-                                                    last_updated_month] += 1
+for batch in simple_log.read_batches(DOWNLOAD_LOG_FILENAME, projects=True):
+  project_ids = table.get_ids(batch.projects)
+  known = project_ids >= 0
+  # Projects without any timestamps would seem to be updated in 1970.
+  known[known] = table.in_package_cache[project_ids[known]] & \
+                 (table.first_timestamps[project_ids[known]] > 0)
+
+  # NOTE: Probably the entire project was deleted after compromise but
+  # before now, or it has no packages left.
+  missing_projects.update(itertools.compress(batch.projects,
+                                             (~known).tolist()))
+  project_ids = project_ids[known]
+
+  # We are looking only at projects did update before compromise.
+  last_updated_timestamps = table.last_timestamps[project_ids]
+
+  # Project was not updated before compromise.
+  # Misnomer, but actually the first time package was updated after
+  # compromise.
+  not_updated = last_updated_timestamps == 0
+  last_updated_timestamps = numpy.where(not_updated,
+                                        table.first_timestamps[project_ids],
+                                        last_updated_timestamps)
+
+  # Question: Why is the user downloading a package from a project that
+  # *seems* to have been last updated in the future?
+  # Answer: Some of these packages seem to have been deleted.  For
+  # example, a user downloaded sparsehash-0.11 which does not exist on
+  # PyPI anymore, and the earliest known package now is sparsehash-0.3
+  # which was updated after the compromise.
+  future = not_updated & (last_updated_timestamps > UNTIL_TIMESTAMP)
+  future_projects.update(table.projects[project_id] for project_id
+                         in numpy.unique(project_ids[future]).tolist())
+
+  count(last_updated_timestamps, dloaded_projects_last_updated_in_year,
+        dloaded_projects_last_updated_in_2014_last_updated_in_month)
 
 print('All downloaded projects were last updated in these years:')
 print(dloaded_projects_last_updated_in_year)